@@ -0,0 +1,77 @@
+import re
+import json
+from typing import Any
+
+def _fast_loads():
+    # orjson se disponibile; json della libreria standard resta il riferimento (accetta anche NaN/Infinity)
+    try:
+        import orjson
+        return orjson.loads
+    except ImportError:
+        return json.loads
+
+# Unico loader JSON veloce del progetto: usato qui e dal driver (db_conn) per le colonne json
+JSON_LOADS = _fast_loads()
+
+class AgtypeDecoder:
+    # Decodifica del testo agtype restituito da AGE: JSON con annotazioni di tipo (::vertex, ::edge,
+    # ::path, ::numeric) dopo i valori, anche annidati (es. [{...}::vertex, {...}::edge]::path).
+    # Una sola scansione lineare toglie le annotazioni fuori dalle stringhe, poi un solo parse JSON
+    ANNOTATIONS = ('vertex', 'edge', 'path', 'numeric', 'integer', 'float')
+
+    # Una stringa JSON completa (gruppo 1, con escape) oppure un'annotazione: le stringhe vengono copiate
+    # intatte, così un '::vertex' o una graffa dentro un valore di proprietà non vengono toccati.
+    # split() restituisce testo e stringhe (gruppo 1) e None al posto delle annotazioni: si ricompone
+    # scartando i None, senza callback Python per token
+    _TOKEN = re.compile(r'("[^"\\]*(?:\\.[^"\\]*)*")|::(?:' + '|'.join(ANNOTATIONS) + r')\b')
+    _loads = staticmethod(JSON_LOADS)
+    # Annotazioni di vertici e archi, sempre subito dopo la graffa che chiude l'oggetto
+    _ELEMENT = re.compile(r'\}::(?:vertex|edge)')
+
+    @classmethod
+    def to_json(cls, text: str) -> str:
+        if '::' not in text:
+            return text
+        return ''.join(filter(None, cls._TOKEN.split(text)))
+
+    @classmethod
+    def decode_graph(cls, text: str) -> Any:
+        # Via veloce per path, vertici e archi: le annotazioni vengono tolte senza isolare le stringhe.
+        # Ogni elemento ne porta esattamente una, quindi se le sostituzioni sono più degli elementi decodificati
+        # una stava dentro un valore di proprietà: si ritorna None e decode() ripiega sulla scansione completa
+        is_path = text.endswith(']::path')
+        clean, replaced = cls._ELEMENT.subn('}', text[:-6] if is_path else text)
+        try:
+            decoded = cls._loads(clean.encode('utf-8'))
+        except ValueError:
+            # Altre annotazioni (es. ::numeric nelle proprietà) o JSON non standard
+            return None
+        if is_path:
+            return decoded if isinstance(decoded, list) and replaced == len(decoded) else None
+        return decoded if isinstance(decoded, dict) and replaced == 1 else None
+
+    @classmethod
+    def decode(cls, value: Any) -> Any:
+        # Valori non testuali (già decodificati) passano invariati; testo non agtype resta com'è
+        if not isinstance(value, str):
+            return value
+        text = value.strip()
+        if text.endswith(('}::vertex', '}::edge')) and text.count('}::') == 1:
+            # Vertice o arco singolo (il caso più comune per colonna): l'unica annotazione è quella finale,
+            # basta toglierla senza scansioni regex
+            try:
+                return cls._loads(text[:text.rfind('::')])
+            except ValueError:
+                pass
+        if text.endswith(('::path', '::vertex', '::edge')):
+            decoded = cls.decode_graph(text)
+            if decoded is not None:
+                return decoded
+        clean = cls.to_json(text)
+        try:
+            return cls._loads(clean)
+        except ValueError:
+            try:
+                return json.loads(clean)
+            except ValueError:
+                return value
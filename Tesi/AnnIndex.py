@@ -0,0 +1,132 @@
+import numpy as np
+from typing import Dict, List, Optional
+
+class IVFIndex:
+    # Indice IVF (inverted file) su vettori normalizzati: k-means sferico per i centroidi,
+    # in ricerca si visitano solo le n_probe liste più vicine alla domanda
+    def __init__(self, n_lists: Optional[int] = None, n_probe: int = 8,
+                 kmeans_iters: int = 10, train_size: int = 256, seed: int = 0):
+        self.n_lists = n_lists
+        self.n_probe = n_probe
+        self.kmeans_iters = kmeans_iters
+        self.train_size = train_size
+        self.seed = seed
+        self.centroids: Optional[np.ndarray] = None
+        self.slot_list: Dict[int, int] = {}
+
+    def _assign(self, vectors: np.ndarray, block_size: int = 65536) -> np.ndarray:
+        assign = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), block_size):
+            block = vectors[start:start + block_size]
+            assign[start:start + block_size] = np.argmax(block @ self.centroids.T, axis=1)
+        return assign
+
+    def build(self, unit_vectors: np.ndarray, ids: Optional[np.ndarray] = None):
+        vectors = np.ascontiguousarray(unit_vectors, dtype=np.float32)
+        n = len(vectors)
+        ids = np.arange(n) if ids is None else np.asarray(ids, dtype=np.int64)
+        if n == 0:
+            return self
+        n_lists = max(1, min(self.n_lists or int(np.sqrt(n)), n))
+        rng = np.random.default_rng(self.seed)
+
+        # Addestramento dei centroidi su un campione
+        sample_size = min(n, n_lists * self.train_size)
+        sample = vectors[rng.choice(n, size=sample_size, replace=False)]
+        self.centroids = sample[rng.choice(sample_size, size=n_lists, replace=False)].copy()
+        for _ in range(self.kmeans_iters):
+            assign = self._assign(sample)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=n_lists)
+            empty = counts == 0
+            # I centroidi rimasti vuoti vengono reinizializzati su punti casuali
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            self.centroids = np.divide(sums, norms, out=np.zeros_like(sums), where=norms > 0)
+
+        # Ogni lista tiene i propri id e vettori: aggiunte e rimozioni toccano solo la lista interessata
+        self.list_ids = [np.empty(0, dtype=np.int64) for _ in range(n_lists)]
+        self.list_vectors = [np.empty((0, vectors.shape[1]), dtype=np.float32) for _ in range(n_lists)]
+        self.slot_list = {}
+        self.add(ids, vectors)
+        return self
+
+    def add(self, ids: np.ndarray, unit_vectors: np.ndarray):
+        vectors = np.ascontiguousarray(unit_vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        if self.centroids is None:
+            self.build(vectors, ids)
+            return
+
+        assign = self._assign(vectors)
+        for c in np.unique(assign):
+            members = assign == c
+            self.list_ids[c] = np.concatenate([self.list_ids[c], ids[members]])
+            self.list_vectors[c] = np.concatenate([self.list_vectors[c], vectors[members]])
+        self.slot_list.update(zip(ids.tolist(), assign.tolist()))
+
+    def remove(self, ids: List[int]):
+        by_list: Dict[int, List[int]] = {}
+        for slot in ids:
+            c = self.slot_list.pop(slot, None)
+            if c is not None:
+                by_list.setdefault(c, []).append(slot)
+        for c, slots in by_list.items():
+            keep = ~np.isin(self.list_ids[c], slots)
+            self.list_ids[c] = self.list_ids[c][keep]
+            self.list_vectors[c] = self.list_vectors[c][keep]
+
+    def remap(self, mapping: np.ndarray):
+        # Slot rinumerati dopo una compattazione: mapping[vecchio slot] = nuovo slot
+        if self.centroids is None:
+            return
+        self.list_ids = [mapping[ids] for ids in self.list_ids]
+        self.slot_list = {int(mapping[slot]): c for slot, c in self.slot_list.items()}
+
+    def search(self, queries: np.ndarray, n_candidates: int) -> np.ndarray:
+        # Candidati per un blocco di domande (una per riga): matrice (domande x n_candidates) di id, -1 dove
+        # mancano. Ogni lista sondata viene letta una sola volta, con tutte le domande che la sondano
+        n = len(queries)
+        if self.centroids is None:
+            return np.full((n, 0), -1, dtype=np.int64)
+        n_lists = len(self.centroids)
+        n_probe = min(self.n_probe, n_lists)
+        centroid_scores = queries @ self.centroids.T
+        if n_probe < n_lists:
+            probe = np.argpartition(-centroid_scores, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probe = np.tile(np.arange(n_lists), (n, 1))
+
+        # Per ogni coppia (domanda, lista sondata) i migliori n_candidates della lista
+        ids = np.full((n, n_probe, n_candidates), -1, dtype=np.int64)
+        scores = np.full((n, n_probe, n_candidates), -np.inf, dtype=np.float32)
+        flat = probe.ravel()
+        order = np.argsort(flat, kind='stable')
+        for group in np.split(order, np.flatnonzero(np.diff(flat[order])) + 1):
+            list_ids = self.list_ids[flat[group[0]]]
+            if not len(list_ids):
+                continue
+            rows, slots = np.divmod(group, n_probe)
+            list_scores = queries[rows] @ self.list_vectors[flat[group[0]]].T
+            found = np.broadcast_to(list_ids, list_scores.shape)
+            if len(list_ids) > n_candidates:
+                top = np.argpartition(-list_scores, n_candidates - 1, axis=1)[:, :n_candidates]
+                list_scores = np.take_along_axis(list_scores, top, axis=1)
+                found = list_ids[top]
+            ids[rows, slots, :found.shape[1]] = found
+            scores[rows, slots, :found.shape[1]] = list_scores
+
+        ids = ids.reshape(n, -1)
+        if ids.shape[1] > n_candidates:
+            top = np.argpartition(-scores.reshape(n, -1), n_candidates - 1, axis=1)[:, :n_candidates]
+            ids = np.take_along_axis(ids, top, axis=1)
+        return ids
+
+    def min_score_estimate(self, queries: np.ndarray) -> np.ndarray:
+        if self.centroids is None:
+            return np.zeros(len(queries), dtype=np.float32)
+        # Stima del punteggio minimo sull'intero banco dal centroide più lontano, per ogni domanda
+        return (queries @ self.centroids.T).min(axis=1)
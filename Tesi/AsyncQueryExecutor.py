@@ -0,0 +1,111 @@
+import time
+import argparse
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from queryExecutor import QueryExecutor, DB_CONFIG
+from Tracer import tracer
+
+load_dotenv()
+
+class AsyncQueryExecutor:
+    # Esecuzione asyncio delle coppie GT/LLM: centinaia di task in un solo thread, con concorrenza
+    # limitata da un semaforo. Confronto, checkpoint e output sono quelli di QueryExecutor
+    def __init__(self, db_config: Dict[str, Optional[str]], concurrency: int = 16,
+                 connections: Optional[int] = None, statement_timeout_ms: Optional[int] = None):
+        # QueryExecutor valida la configurazione e fornisce la logica di confronto (nessuna connessione aperta)
+        self.sync = QueryExecutor(db_config)
+        from async_db_conn import async_db_conn
+        self.db = async_db_conn(self.sync.db.db_config, pool_size=connections or concurrency)
+        self.concurrency = concurrency
+        self.statement_timeout_ms = statement_timeout_ms
+        self._semaphore: Optional['asyncio.Semaphore'] = None
+
+    async def connect(self):
+        # asyncio importato solo quando serve: tiene --help entro il budget di import_profile
+        import asyncio
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        await self.db.connect()
+
+    async def disconnect(self):
+        await self.db.disconnect()
+
+    async def execute_query(self, query: str, query_id: str) -> Dict:
+        from db_conn import QueryTimeout
+        async with self._semaphore:
+            try:
+                start = time.perf_counter()
+                with tracer.span('db_execution', query_id=query_id) as span:
+                    rows, columns = await self.db.execute_raw(query, self.statement_timeout_ms)
+                    span['rows'] = len(rows)
+                exec_time = time.perf_counter() - start
+            except QueryTimeout as e:
+                print(f"Timeout in {query_id}: {e}")
+                return {"query_id": query_id, "results": [], "outcome": "timeout", "error": str(e)}
+            except Exception as e:
+                print(f"Errore in {query_id}: {e}")
+                return {"query_id": query_id, "results": [], "outcome": "error", "error": str(e)}
+
+        results = [{columns[i]: self.db.parse_agtype(value) for i, value in enumerate(row)} for row in rows]
+        print(f"{query_id}: {len(results)} rows, {exec_time:.3f}s")
+        return {"query_id": query_id, "results": results, "outcome": "ok"}
+
+    async def execute_pair(self, q_id: str, gt_query: str, llm_query: str) -> Dict:
+        import asyncio
+        # GT e LLM della stessa query in parallelo
+        gt_result, llm_result = await asyncio.gather(
+            self.execute_query(gt_query, f"{q_id}_GT"),
+            self.execute_query(llm_query, f"{q_id}_LLM")
+        )
+        return self.sync.pair_result(q_id, gt_query, llm_query, gt_result, llm_result)
+
+    async def run(self, gt_file: str, llm_file: str, output_file: str, fresh: bool = False):
+        import asyncio
+        gt_map = self.sync.load_queries(gt_file, 'responses_results')
+        llm_map = self.sync.load_queries(llm_file, 'responses')
+        query_ids = set(gt_map.keys()) & set(llm_map.keys())
+
+        print(f"\n{'='*70}")
+        print(f"Comparing {len(query_ids)} queries (async, concurrency {self.concurrency})")
+        print(f"{'='*70}\n")
+
+        checkpoint = self.sync.open_checkpoint(output_file, fresh=fresh)
+        pending: List[str] = [q_id for q_id in sorted(query_ids)
+                              if not self.sync.is_done(checkpoint, q_id, gt_map[q_id]['query'], llm_map[q_id]['query'])]
+
+        loop = asyncio.get_running_loop()
+
+        async def process(q_id: str):
+            executed = await self.execute_pair(q_id, gt_map[q_id]['query'], llm_map[q_id]['query'])
+            # Il confronto è lavoro CPU: va su un thread per non bloccare l'event loop
+            record = await loop.run_in_executor(None, self.sync.compare_pair, executed)
+            checkpoint.append(record)
+
+        await self.connect()
+        try:
+            await asyncio.gather(*(process(q_id) for q_id in pending))
+        finally:
+            await self.disconnect()
+
+        self.sync.save_output(checkpoint, gt_file, llm_file, output_file, query_ids)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare AGE queries (GT vs LLM) with an asyncio DB layer')
+    parser.add_argument('gt_file', help='Ground truth YAML file')
+    parser.add_argument('llm_file', help='LLM generated YAML file')
+    parser.add_argument('output_file', help='Output JSON file')
+    parser.add_argument('--concurrency', type=int, default=16, help='Queries in flight at the same time')
+    parser.add_argument('--connections', type=int, help='Pooled connections (default: same as --concurrency)')
+    parser.add_argument('--timeout-ms', type=int, help='statement_timeout applied to every query')
+    parser.add_argument('--fresh', action='store_true', help='Ignore the checkpoint and rerun every query')
+    args = parser.parse_args()
+
+    import asyncio
+    executor = AsyncQueryExecutor(DB_CONFIG, concurrency=args.concurrency, connections=args.connections,
+                                  statement_timeout_ms=args.timeout_ms)
+    asyncio.run(executor.run(args.gt_file, args.llm_file, args.output_file, fresh=args.fresh))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+import time
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+from EmbeddingStore import EmbeddingStore
+
+class RateLimiter:
+    # Limita il numero di richieste al secondo condiviso tra tutti i thread
+    def __init__(self, requests_per_second: float):
+        self.interval = 1.0 / requests_per_second if requests_per_second > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next_slot)
+            self._next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+class BulkEmbedder:
+    def __init__(self, embed_fn: Callable[[List[str]], np.ndarray],
+                 store: EmbeddingStore,
+                 chunk_size: int = 96,
+                 max_workers: int = 4,
+                 requests_per_second: float = 5.0,
+                 max_retries: int = 3):
+        self.embed_fn = embed_fn
+        self.store = store
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.limiter = RateLimiter(requests_per_second)
+        self.max_retries = max_retries
+
+    def _embed_chunk(self, chunk: List[str]) -> int:
+        for attempt in range(1, self.max_retries + 1):
+            self.limiter.acquire()
+            try:
+                vectors = self.embed_fn(chunk)
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                print(f"Blocco di {len(chunk)} embedding fallito ({e}), tentativo {attempt}/{self.max_retries}")
+                time.sleep(2 ** attempt)
+        # Checkpoint immediato: un'interruzione successiva non fa perdere questo blocco
+        self.store.append_segment(chunk, vectors)
+        return len(chunk)
+
+    def embed_all(self, texts: List[str]) -> Tuple[np.ndarray, List[int]]:
+        # Ritorna gli embedding di tutti i testi e gli indici di quelli che non è stato possibile calcolare
+        vectors, missing = self.store.lookup(texts)
+        pending = list(dict.fromkeys(texts[i] for i in missing))
+        if not pending:
+            return vectors, missing
+
+        chunks = [pending[i:i + self.chunk_size] for i in range(0, len(pending), self.chunk_size)]
+        print(f"Calcolo embedding di {len(pending)} testi in {len(chunks)} blocchi ({self.max_workers} worker)")
+
+        done = 0
+        failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            futures = [pool.submit(self._embed_chunk, chunk) for chunk in chunks]
+            for future in as_completed(futures):
+                try:
+                    done += future.result()
+                except Exception as e:
+                    failed += 1
+                    print(f"Blocco embedding non calcolato: {e}")
+        print(f"Embedding calcolati: {done}/{len(pending)} ({failed} blocchi falliti)")
+
+        vectors, missing = self.store.lookup(texts)
+        return vectors, missing
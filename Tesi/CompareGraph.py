@@ -1,82 +1,106 @@
-from typing import Dict, List, Set, Tuple, Any
-import json
+from itertools import compress, repeat
+from operator import contains, is_, itemgetter
+import numpy as np
+from typing import Dict, Iterable, List, Set, Tuple, Any, Union
 from config_dataclasses import ComparisonMetrics
+from AgtypeDecoder import AgtypeDecoder
+
+class SymbolTable:
+    # URN e label rappresentati da interi: ogni stringa distinta è salvata una sola volta.
+    # Una tabella per estrazione (GraphBuilder) e una per confronto: nessuno stato di processo che cresce
+    # tra una run e l'altra, e nessuna condivisione tra thread
+    def __init__(self):
+        self._ids: Dict[str, int] = {}
+        self._strings: List[str] = []
+
+    def encode(self, values: List[str]) -> List[int]:
+        # Ricerche con map() sul dizionario, senza cicli Python; le stringhe nuove vengono aggiunte in blocco
+        encoded = list(map(self._ids.get, values))
+        if None in encoded:
+            # Solo i valori non trovati, senza duplicati e nell'ordine di arrivo
+            missing = list(dict.fromkeys(compress(values, map(is_, encoded, repeat(None)))))
+            self._ids.update(zip(missing, range(len(self._strings), len(self._strings) + len(missing))))
+            self._strings.extend(missing)
+            encoded = list(map(self._ids.__getitem__, values))
+        return encoded
+
+    def encode_rows(self, rows: Iterable[Tuple[str, ...]], width: int) -> np.ndarray:
+        rows = list(rows)
+        encoded = np.empty((len(rows), width), dtype=np.int32)
+        for column in range(width):
+            encoded[:, column] = self.encode(list(map(itemgetter(column), rows)))
+        return encoded
+
+    def lookup(self, rows: np.ndarray) -> List[Tuple[str, ...]]:
+        columns = [map(self._strings.__getitem__, column) for column in rows.T.tolist()]
+        return list(zip(*columns))
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+    @property
+    def strings(self) -> List[str]:
+        return self._strings
+
+    def copy(self) -> 'SymbolTable':
+        table = SymbolTable()
+        table._ids = dict(self._ids)
+        table._strings = list(self._strings)
+        return table
+
+class GraphElements:
+    # Nodi (urn, label) e archi (start, end, tipo) come righe di id interi: array int32 (n, 2) e (m, 3),
+    # 8 e 12 byte per elemento invece di tuple di stringhe. Gli id valgono nella tabella 'symbols'
+    # dell'estrazione. 'nodes, edges = elements' resta valido
+    def __init__(self, nodes: np.ndarray, edges: np.ndarray, symbols: SymbolTable):
+        self.nodes = nodes
+        self.edges = edges
+        self.symbols = symbols
+
+    def __iter__(self):
+        return iter((self.nodes, self.edges))
+
+    @classmethod
+    def from_tuples(cls, nodes: Iterable[Tuple], edges: Iterable[Tuple]) -> 'GraphElements':
+        # Insiemi di tuple di stringhe (estrazione, cache su disco) -> righe di id senza duplicati
+        if not isinstance(nodes, set):
+            nodes = {tuple(node) for node in nodes}
+        if not isinstance(edges, set):
+            edges = {tuple(edge) for edge in edges}
+        symbols = SymbolTable()
+        return cls(symbols.encode_rows(nodes, 2), symbols.encode_rows(edges, 3), symbols)
+
+    @classmethod
+    def coerce(cls, elements: Union['GraphElements', Tuple[Set, Set]]) -> 'GraphElements':
+        if isinstance(elements, cls):
+            return elements
+        return cls.from_tuples(*elements)
+
+    def recode(self, symbols: SymbolTable) -> Tuple[np.ndarray, np.ndarray]:
+        # Stesse righe con gli id di un'altra tabella: una ricerca per simbolo distinto, poi indicizzazione numpy
+        if symbols is self.symbols:
+            return self.nodes, self.edges
+        mapping = np.array(symbols.encode(self.symbols.strings), dtype=np.int32)
+        return mapping[self.nodes], mapping[self.edges]
+
+    def node_tuples(self) -> List[Tuple[str, ...]]:
+        return self.symbols.lookup(self.nodes)
+
+    def edge_tuples(self) -> List[Tuple[str, ...]]:
+        return self.symbols.lookup(self.edges)
+
 
 class CompareGraph:
 
-    @staticmethod
-    def normalize_node(node: Dict) -> Tuple[str, str]:
-        properties = node.get('properties', {})
-        node_id = properties.get('id', '')
-        label = node.get('label', '')
-        return (str(node_id), str(label))
-    
-    @staticmethod
-    def normalize_edge(edge: Dict) -> Tuple[str, str, str, str]:
-        start = edge.get('start_id', '')
-        end = edge.get('end_id', '')
-        edge_type = edge.get('label', edge.get('type', ''))
-        edge_id = edge.get('id', '')
-        return (str(start), str(end), str(edge_type), str(edge_id))
-    
-    @staticmethod
-    def parse_path(value: str) -> list:
-        # Rimuove ::path finale e parentesi quadre esterne
-        inner = value.strip()
-        if '::path' in inner:
-            inner = inner[:inner.rfind('::path')].strip()
-        if inner.startswith('['):
-            inner = inner[1:]
-        if inner.endswith(']'):
-            inner = inner[:-1]
-        
-        elements = []
-        depth = 0
-        current = []
-
-        for char in inner:
-            if char == '{':
-                depth += 1
-                current.append(char)
-            elif char == '}':
-                depth -= 1
-                current.append(char)
-                if depth == 0:
-                    # Oggetto JSON completo — estrailo
-                    json_str = ''.join(current).strip()
-                    try:
-                        elements.append(json.loads(json_str))
-                    except json.JSONDecodeError:
-                        pass
-                    current = []
-            elif depth > 0:
-                # Siamo dentro un oggetto, accumula tutto
-                current.append(char)
-            # Se depth == 0 e non siamo in un oggetto,
-            # siamo su virgole o suffissi ::vertex/::edge — li ignoriamo
-        
-        return elements
+    # Elementi oltre i quali un path viene letto in blocco (extract_path) invece che visitato
+    BULK_PATH = 64
 
     @staticmethod
     def parse_agtype_value(value: Any) -> Any:
+        # Vertici, archi, path e valori annidati in una sola passata (vedi AgtypeDecoder)
         if value is None:
             return None
-        
-        if isinstance(value, str):
-            stripped = value.strip()
-            
-            # Caso path AGE: [..., {...}::vertex, {...}::edge, ...]::path
-            if stripped.endswith('::path'):
-                return CompareGraph.parse_path(stripped)
-            
-            # Caso normale: {…}::vertex o {…}::edge
-            clean_value = stripped.split('::')[0].strip()
-            try:
-                return json.loads(clean_value)
-            except (json.JSONDecodeError, ValueError):
-                return value
-        
-        return value
+        return AgtypeDecoder.decode(value)
     
     @staticmethod
     def is_node(item: Any) -> bool:
@@ -103,82 +127,256 @@ class CompareGraph:
         return has_start and has_end and has_label
     
     @staticmethod
-    def extract_from_item(item: Any, nodes: Set, edges: Set, node_id_map: Dict):
-        if item is None:
-            return
-        
-        item = CompareGraph.parse_agtype_value(item)
-        
-        if isinstance(item, dict):
-            if CompareGraph.is_edge(item):
-                edge_tuple = CompareGraph.normalize_edge(item)
-                edges.add(edge_tuple)
-            elif CompareGraph.is_node(item):
-                node_tuple = CompareGraph.normalize_node(item)
-                nodes.add(node_tuple)
-                internal_id = str(item.get('id', ''))
-                semantic_id = str(item.get('properties', {}).get('id', ''))
-                if internal_id and semantic_id:
-                    node_id_map[internal_id] = semantic_id
-            else:
-                for value in item.values():
-                    CompareGraph.extract_from_item(value, nodes, edges, node_id_map)
-                
-        elif isinstance(item, list):
-            for element in item:
-                CompareGraph.extract_from_item(element, nodes, edges, node_id_map)
+    def extract_path(path: List[Any], builder: 'GraphBuilder') -> bool:
+        # Path decodificato: vertici nelle posizioni pari e archi nelle dispari. Gli elementi vengono letti
+        # in blocco, senza visitarne i valori uno a uno; False se la lista non ha questa forma
+        vertices = path[0::2]
+        links = path[1::2]
+        try:
+            # map/itemgetter: accessi ai campi in C, una lista per campo
+            if any(map(contains, vertices, repeat('start_id'))) or any(map(contains, vertices, repeat('end_id'))):
+                return False
+            semantic = list(map(itemgetter('id'), map(itemgetter('properties'), vertices)))
+            labels = list(map(itemgetter('label'), vertices))
+            internal = list(map(itemgetter('id'), vertices))
+            starts = list(map(itemgetter('start_id'), links))
+            ends = list(map(itemgetter('end_id'), links))
+            types = list(map(itemgetter('label'), links))
+        except (KeyError, TypeError):
+            return False
+        builder.node_ids.extend(semantic)
+        builder.node_labels.extend(labels)
+        builder.node_internal.extend(internal)
+        builder.edge_starts.extend(starts)
+        builder.edge_ends.extend(ends)
+        builder.edge_types.extend(types)
+        return True
 
     @staticmethod
-    def resolve_edges(edges: Set, node_id_map: Dict) -> Set:
-        resolved_edges = set()
-        
-        for start_internal, end_internal, edge_type, edge_id in edges:
+    def extract_from_values(values: Iterable[Any], builder: 'GraphBuilder'):
+        # Valori di colonna di una riga. Ogni vertice/arco trovato aggiunge i suoi campi grezzi alle colonne
+        # del builder (stessi criteri di is_edge/is_node, verificati qui in linea): niente tuple né
+        # interning per elemento, le stringhe diventano id interi a blocchi in GraphBuilder.flush()
+        stack = []
+        for value in values:
+            if value is None:
+                continue
+            # Solo il valore di colonna viene decodificato; le stringhe annidate sono già dati (proprietà)
+            if isinstance(value, str):
+                value = AgtypeDecoder.decode(value)
+            # Lettura in blocco solo per path lunghi: su pochi elementi costa più della visita
+            if isinstance(value, list) and len(value) % 2 and len(value) >= CompareGraph.BULK_PATH and \
+                    CompareGraph.extract_path(value, builder):
+                continue
+            stack.append(value)
 
-            start_semantic = node_id_map.get(start_internal, start_internal)
-            end_semantic = node_id_map.get(end_internal, end_internal)
-            
-            resolved_edges.add((start_semantic, end_semantic, edge_type))
-        
-        return resolved_edges
+        node_ids = builder.node_ids.append
+        node_labels = builder.node_labels.append
+        node_internal = builder.node_internal.append
+        edge_starts = builder.edge_starts.append
+        edge_ends = builder.edge_ends.append
+        edge_types = builder.edge_types.append
+        # Visita iterativa con uno stack esplicito: nessun limite di ricorsione su path molto lunghi
+        while stack:
+            item = stack.pop()
+            if isinstance(item, dict):
+                if 'start_id' in item or 'end_id' in item:
+                    if 'start_id' in item and 'end_id' in item and 'label' in item:
+                        edge_starts(item['start_id'])
+                        edge_ends(item['end_id'])
+                        edge_types(item['label'])
+                        continue
+                elif 'label' in item:
+                    properties = item.get('properties', {})
+                    if isinstance(properties, dict) and 'id' in properties:
+                        node_ids(properties['id'])
+                        node_labels(item['label'])
+                        node_internal(item.get('id', ''))
+                        continue
+                stack.extend(item.values())
+            elif isinstance(item, list):
+                stack.extend(item)
 
     @staticmethod
-    def extract_graph_elements(results: List[Dict]) -> Tuple[Set, Set]:
-        nodes = set()
-        edges = set()
-        node_id_map = {}
-        
+    def unique_rows(rows: np.ndarray) -> np.ndarray:
+        # Righe distinte (in ordine di chiave)
+        if not len(rows):
+            return rows
+        width = max(int(rows.max()), 1).bit_length()
+        _, index = np.unique(CompareGraph._keys(rows, width), return_index=True)
+        return rows[index]
+
+    @staticmethod
+    def _keys(rows: np.ndarray, width: int) -> np.ndarray:
+        # Una chiave scalare per riga: id impacchettati in un int64 finché ci stanno (width bit per colonna),
+        # altrimenti la riga come blocco di byte. In entrambi i casi le differenze sono operazioni numpy
+        if width * rows.shape[1] <= 63:
+            keys = np.zeros(len(rows), dtype=np.int64)
+            for column in range(rows.shape[1]):
+                keys = (keys << width) | rows[:, column].astype(np.int64)
+            return keys
+        rows = np.ascontiguousarray(rows)
+        return rows.view(np.dtype((np.void, rows.dtype.itemsize * rows.shape[1]))).ravel()
+
+    @staticmethod
+    def _only_in(keys: np.ndarray, other: np.ndarray) -> np.ndarray:
+        # Chiavi ordinate di un lato cercate nell'altro, anch'esso ordinato: accessi sequenziali
+        if not len(other):
+            return np.ones(len(keys), dtype=bool)
+        positions = np.minimum(np.searchsorted(other, keys), len(other) - 1)
+        return other[positions] != keys
+
+    @staticmethod
+    def difference(a: np.ndarray, b: np.ndarray, symbols: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Righe solo in a e righe solo in b (in ordine di chiave): un ordinamento per lato e ricerche binarie
+        width = max(symbols, 1).bit_length()
+        keys_a = CompareGraph._keys(a, width)
+        keys_b = CompareGraph._keys(b, width)
+        order_a = np.argsort(keys_a)
+        order_b = np.argsort(keys_b)
+        keys_a = keys_a[order_a]
+        keys_b = keys_b[order_b]
+        return (a[order_a[CompareGraph._only_in(keys_a, keys_b)]],
+                b[order_b[CompareGraph._only_in(keys_b, keys_a)]])
+
+    @staticmethod
+    def extract_graph_elements(results: List[Dict]) -> GraphElements:
+        builder = GraphBuilder()
         for row in results:
-            for value in row.values():
-                CompareGraph.extract_from_item(value, nodes, edges, node_id_map)
-        
-        resolved_edges = CompareGraph.resolve_edges(edges, node_id_map)
-        
-        return nodes, resolved_edges
+            builder.add_row(row.values())
+        return builder.elements()
     
     @staticmethod
     def compare(results_gt: List[Dict], results_llm: List[Dict], id: str) -> ComparisonMetrics:
+        return CompareGraph.compare_elements(
+            CompareGraph.extract_graph_elements(results_gt),
+            CompareGraph.extract_graph_elements(results_llm),
+            id
+        )
 
-        gt_nodes, gt_edges = CompareGraph.extract_graph_elements(results_gt)
-        llm_nodes, llm_edges = CompareGraph.extract_graph_elements(results_llm)
-
-        missllm_nodes = gt_nodes - llm_nodes
-        extrallm_nodes = llm_nodes - gt_nodes
+    @staticmethod
+    def compare_elements(gt_elements: Union[GraphElements, Tuple[Set, Set]],
+                         llm_elements: Union[GraphElements, Tuple[Set, Set]], id: str) -> ComparisonMetrics:
+        # Confronto su insiemi di nodi/archi già estratti (anche in streaming con GraphBuilder).
+        # Differenze vettoriali sugli id interi; solo gli elementi diversi tornano tuple di stringhe
+        gt_elements = GraphElements.coerce(gt_elements)
+        llm_elements = GraphElements.coerce(llm_elements)
+        # I due lati vengono riportati su una tabella del confronto (copia di quella GT, così le righe GT
+        # restano valide), scartata a confronto finito
+        symbols = gt_elements.symbols if gt_elements.symbols is llm_elements.symbols else gt_elements.symbols.copy()
+        gt_nodes, gt_edges = gt_elements.nodes, gt_elements.edges
+        llm_nodes, llm_edges = llm_elements.recode(symbols)
 
-        missllm_edges = gt_edges - llm_edges
-        extrallm_edges = llm_edges - gt_edges
+        missllm_nodes, extrallm_nodes = CompareGraph.difference(gt_nodes, llm_nodes, len(symbols))
+        missllm_edges, extrallm_edges = CompareGraph.difference(gt_edges, llm_edges, len(symbols))
 
         return ComparisonMetrics(
             query_id=id,
             missing_llm={
-                'nodes': list(missllm_nodes),
-                'edges': list(missllm_edges)
+                'nodes': symbols.lookup(missllm_nodes),
+                'edges': symbols.lookup(missllm_edges)
             },
             extra_llm={
-                'nodes': list(extrallm_nodes),
-                'edges': list(extrallm_edges)
+                'nodes': symbols.lookup(extrallm_nodes),
+                'edges': symbols.lookup(extrallm_edges)
             },
             nodes_gt=len(gt_nodes),
             nodes_llm=len(llm_nodes),
             edges_gt=len(gt_edges),
             edges_llm=len(llm_edges)
-        )
\ No newline at end of file
+        )
+
+
+class UniqueRows:
+    # Righe di id interi senza duplicati, accumulate a blocchi. La deduplicazione avviene quando i blocchi
+    # in attesa superano le righe già distinte: la memoria resta proporzionale agli elementi distinti
+    def __init__(self, width: int):
+        self._unique = np.empty((0, width), dtype=np.int32)
+        self._pending: List[np.ndarray] = []
+        self._pending_rows = 0
+
+    def add(self, rows: np.ndarray):
+        self._pending.append(rows)
+        self._pending_rows += len(rows)
+        if self._pending_rows > len(self._unique):
+            self._merge()
+
+    def _merge(self):
+        self._unique = CompareGraph.unique_rows(np.concatenate([self._unique] + self._pending))
+        self._pending = []
+        self._pending_rows = 0
+
+    def array(self) -> np.ndarray:
+        if self._pending:
+            self._merge()
+        return self._unique
+
+
+class GraphBuilder:
+    # Costruzione incrementale degli insiemi di nodi e archi: le righe vengono consumate una alla volta,
+    # quindi la memoria dipende dagli elementi distinti del grafo e non dal numero di righe
+    # Elementi trovati dopo i quali le colonne grezze vengono convertite in righe di id
+    FLUSH_ELEMENTS = 16384
+
+    def __init__(self):
+        # Tabella dei simboli di questa estrazione: vive quanto gli elementi che produce
+        self.symbols = SymbolTable()
+        # Id interni AGE in una tabella a parte: gli estremi degli archi diventano URN solo in elements()
+        self.internal_ids = SymbolTable()
+        # Campi grezzi degli elementi trovati dall'ultimo flush
+        self.node_ids: List[Any] = []
+        self.node_labels: List[Any] = []
+        self.node_internal: List[Any] = []
+        self.edge_starts: List[Any] = []
+        self.edge_ends: List[Any] = []
+        self.edge_types: List[Any] = []
+        # Nodi (urn, label) e archi (start interno, end interno, tipo) già convertiti
+        self.nodes = UniqueRows(2)
+        self.edges = UniqueRows(3)
+        # Id interno (simbolo in internal_ids) -> simbolo dell'URN
+        self.node_id_map: Dict[int, int] = {}
+        self.rows = 0
+
+    def add_row(self, values: Iterable[Any]):
+        CompareGraph.extract_from_values(values, self)
+        self.rows += 1
+        if len(self.node_ids) + len(self.edge_starts) >= self.FLUSH_ELEMENTS:
+            self.flush()
+
+    def flush(self):
+        # Interning in blocco con map() sui dizionari delle tabelle (SymbolTable.encode), una colonna alla volta
+        symbols = self.symbols
+        if self.node_ids:
+            semantic = list(map(str, self.node_ids))
+            ids = symbols.encode(semantic)
+            internal = self.internal_ids.encode(self.node_internal)
+            self.nodes.add(np.array([ids, symbols.encode(list(map(str, self.node_labels)))], dtype=np.int32).T)
+            # Solo i vertici con id interno e URN non vuoti entrano nella mappa
+            if '' in semantic or '' in self.node_internal:
+                self.node_id_map.update((i, s) for i, s, raw_i, raw_s in zip(internal, ids, self.node_internal, semantic)
+                                        if raw_i != '' and raw_s != '')
+            else:
+                self.node_id_map.update(zip(internal, ids))
+            self.node_ids, self.node_labels, self.node_internal = [], [], []
+        if self.edge_starts:
+            self.edges.add(np.array([self.internal_ids.encode(self.edge_starts),
+                                     self.internal_ids.encode(self.edge_ends),
+                                     symbols.encode(list(map(str, self.edge_types)))], dtype=np.int32).T)
+            self.edge_starts, self.edge_ends, self.edge_types = [], [], []
+
+    def elements(self) -> GraphElements:
+        # Forma compatta (id interi): è quella che resta in memoria fino al confronto e in cache
+        self.flush()
+        edges = self.edges.array()
+        # Id interno -> simbolo dell'URN; un estremo senza vertice nei risultati resta il suo id interno
+        semantic = np.full(len(self.internal_ids), -1, dtype=np.int64)
+        if self.node_id_map:
+            semantic[np.fromiter(self.node_id_map.keys(), dtype=np.int64, count=len(self.node_id_map))] = \
+                np.fromiter(self.node_id_map.values(), dtype=np.int64, count=len(self.node_id_map))
+        endpoints = edges[:, :2]
+        unresolved = np.unique(endpoints[semantic[endpoints] < 0]).tolist()
+        if unresolved:
+            strings = self.internal_ids.strings
+            semantic[unresolved] = self.symbols.encode([str(strings[i]) for i in unresolved])
+        edges = np.column_stack([semantic[edges[:, 0]], semantic[edges[:, 1]], edges[:, 2]]).astype(np.int32)
+        return GraphElements(self.nodes.array(), CompareGraph.unique_rows(edges), self.symbols)
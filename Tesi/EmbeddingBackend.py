@@ -0,0 +1,70 @@
+import re
+import zlib
+import numpy as np
+from typing import Dict, List
+
+class AzureEmbeddingBackend:
+    # Embedding remoti tramite l'endpoint Azure AI Inference (default: Cohere multilingue)
+    max_batch_size = 96
+    requests_per_second = 5.0
+
+    def __init__(self, token: str, model_name: str = "cohere-embed-v3-multilingual", dim: int = 1024):
+        if not token:
+            raise ValueError("Token di accesso non fornito al backend di embedding")
+
+        from azure.ai.inference import EmbeddingsClient
+        from azure.core.credentials import AzureKeyCredential
+
+        self.name = model_name
+        self.dim = dim
+        self.client = EmbeddingsClient(
+            endpoint="https://models.inference.ai.azure.com",
+            credential=AzureKeyCredential(token)
+        )
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        response = self.client.embed(input=texts, model=self.name)
+        return np.array([item.embedding for item in response.data], dtype=np.float32)
+
+class HashingEmbeddingBackend:
+    # Embedding locali su CPU: n-grammi di caratteri e parole proiettati con hashing su `dim` dimensioni.
+    # Non serve rete né modello su disco, il risultato è deterministico
+    max_batch_size = 4096
+    requests_per_second = 0.0
+    TOKEN_PATTERN = re.compile(r"(?u)\w+")
+
+    def __init__(self, dim: int = 512, ngram_range: tuple = (3, 5)):
+        self.dim = dim
+        self.ngram_range = tuple(ngram_range)
+        self.name = f"hashing-char{self.ngram_range[0]}-{self.ngram_range[1]}-{dim}"
+
+    def _features(self, text: str) -> List[str]:
+        words = self.TOKEN_PATTERN.findall(text.lower())
+        features = [f"w:{w}" for w in words]
+        low, high = self.ngram_range
+        for word in words:
+            padded = f" {word} "
+            for n in range(low, high + 1):
+                features.extend(padded[i:i + n] for i in range(len(padded) - n + 1))
+        return features
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                h = zlib.crc32(feature.encode('utf-8'))
+                # Il bit alto sceglie il segno: riduce il bias dovuto alle collisioni
+                vectors[row, h % self.dim] += 1.0 if h & 0x80000000 else -1.0
+        # Scala sublineare dei conteggi, poi normalizzazione L2
+        vectors = np.sign(vectors) * np.log1p(np.abs(vectors))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+def create_embedding_backend(config: Dict, token: str = None):
+    # Backend selezionabile da pipeline_conf.yaml con la chiave `embedding_backend`
+    backend = config.get('embedding_backend', 'azure')
+    if backend == 'azure':
+        return AzureEmbeddingBackend(token, model_name=config.get('embedding_model', 'cohere-embed-v3-multilingual'))
+    if backend == 'hashing':
+        return HashingEmbeddingBackend(dim=config.get('embedding_dim', 512))
+    raise ValueError(f"Backend di embedding non supportato: {backend}")
@@ -0,0 +1,256 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+class EmbeddingStore:
+    # Cambiare la versione invalida tutti gli store già salvati
+    STORE_VERSION = 1
+    MANIFEST_FILE = "manifest.json"
+    SEGMENTS_DIR = "segments"
+    BANKS_DIR = "banks"
+    # Posizioni dei banchi recenti conservate su disco
+    MAX_BANKS = 8
+
+    def __init__(self, store_dir: str, model_name: str):
+        self.store_dir = store_dir
+        self.model_name = model_name
+        # Segmenti in sola aggiunta: le righe non cambiano mai posizione globale
+        self.segments: List[Dict] = []
+        self.dim: Optional[int] = None
+        self._blocks: List[np.ndarray] = []
+        self._offsets = np.zeros(1, dtype=np.int64)
+        # Chiavi caricate solo quando servono (testi nuovi o banco mai visto)
+        self._positions: Optional[Dict[str, int]] = None
+        self._lock = threading.RLock()
+        self._load()
+        # Segmenti scritti da un'indicizzazione interrotta ma non ancora registrati
+        self.compact()
+
+    def key(self, text: str) -> str:
+        # La chiave dipende sia dal testo che dal modello: cambiare modello invalida gli embedding
+        return hashlib.sha256(f"{self.model_name}\x00{text}".encode('utf-8')).hexdigest()
+
+    def bank_key(self, texts: List[str]) -> str:
+        # Un solo hash per l'intero banco (ordine compreso) invece di uno per testo
+        payload = "\x00".join([self.model_name, str(len(texts))] + texts)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    @property
+    def rows(self) -> int:
+        return int(self._offsets[-1])
+
+    def _path(self, *parts: str) -> str:
+        return os.path.join(self.store_dir, *parts)
+
+    def _load(self):
+        manifest_path = self._path(self.MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            return
+
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('version') != self.STORE_VERSION or manifest.get('model') != self.model_name:
+                print(f"Store embedding in {self.store_dir} non compatibile (versione o modello diversi). Verrà ricostruito")
+                return
+            # Memory-map: i segmenti non vengono letti finché non servono
+            blocks = [np.load(self._path(self.SEGMENTS_DIR, seg['name'] + ".npy"), mmap_mode='r')
+                      for seg in manifest['segments']]
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Store embedding corrotto ({e}). Verrà ricostruito")
+            return
+
+        if any(b.ndim != 2 or b.shape[0] != seg['rows'] for b, seg in zip(blocks, manifest['segments'])):
+            print("Store embedding incoerente con il manifest. Verrà ricostruito")
+            return
+        self.segments = manifest['segments']
+        self.dim = manifest.get('dim')
+        self._set_blocks(blocks)
+
+    def _set_blocks(self, blocks: List[np.ndarray]):
+        self._blocks = blocks
+        self._offsets = np.concatenate([[0], np.cumsum([len(b) for b in blocks], dtype=np.int64)]).astype(np.int64)
+        if blocks and self.dim is None:
+            self.dim = int(blocks[0].shape[1])
+
+    def _keys_of(self, name: str) -> List[str]:
+        with open(self._path(self.SEGMENTS_DIR, name + ".json"), 'r', encoding='utf-8') as f:
+            return json.load(f)['keys']
+
+    def _ensure_positions(self) -> Dict[str, int]:
+        # Indice chiave -> riga globale, costruito leggendo le chiavi dei segmenti solo alla prima necessità
+        if self._positions is None:
+            positions = {}
+            row = 0
+            for seg in self.segments:
+                for k in self._keys_of(seg['name']):
+                    positions.setdefault(k, row)
+                    row += 1
+            self._positions = positions
+        return self._positions
+
+    def _gather(self, positions: np.ndarray) -> np.ndarray:
+        # Righe globali -> vettori, un'indicizzazione per segmento
+        vectors = np.zeros((len(positions), self.dim), dtype=np.float32)
+        block_ids = np.searchsorted(self._offsets, positions, side='right') - 1
+        for b in np.unique(block_ids[positions >= 0]).tolist():
+            rows = np.flatnonzero(block_ids == b)
+            vectors[rows] = self._blocks[b][positions[rows] - self._offsets[b]]
+        return vectors
+
+    def lookup(self, texts: List[str]) -> Tuple[Optional[np.ndarray], List[int]]:
+        # Ritorna la matrice con le righe già note e gli indici dei testi da calcolare
+        with self._lock:
+            if self.dim is None:
+                return None, list(range(len(texts)))
+
+            # Banco già visto: le posizioni salvate evitano di calcolare e cercare una chiave per testo
+            bank_path = self._path(self.BANKS_DIR, self.bank_key(texts) + ".npy") if len(texts) > 1 else None
+            positions = None
+            if bank_path and os.path.exists(bank_path):
+                try:
+                    positions = np.load(bank_path)
+                except (OSError, ValueError):
+                    positions = None
+                if positions is not None and (len(positions) != len(texts) or positions.max(initial=-1) >= self.rows):
+                    positions = None
+
+            if positions is None or (positions < 0).any():
+                index = self._ensure_positions()
+                positions = np.fromiter((index.get(self.key(t), -1) for t in texts), dtype=np.int64, count=len(texts))
+                if bank_path and (positions >= 0).all():
+                    self._save_bank(bank_path, positions)
+
+            missing = np.flatnonzero(positions < 0).tolist()
+            return self._gather(positions), missing
+
+    def _save_bank(self, bank_path: str, positions: np.ndarray):
+        banks_dir = os.path.dirname(bank_path)
+        os.makedirs(banks_dir, exist_ok=True)
+        with open(bank_path + ".tmp", 'wb') as f:
+            np.save(f, positions)
+        os.replace(bank_path + ".tmp", bank_path)
+        # Restano solo i banchi usati più di recente
+        banks = sorted((os.path.join(banks_dir, n) for n in os.listdir(banks_dir) if n.endswith(".npy")),
+                       key=os.path.getmtime, reverse=True)
+        for path in banks[self.MAX_BANKS:]:
+            os.remove(path)
+
+    def append_segment(self, texts: List[str], vectors: np.ndarray):
+        # Aggiunta persistente: un nuovo segmento, i segmenti esistenti non vengono riscritti
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(texts) != vectors.shape[0]:
+            raise ValueError("Numero di testi e di embedding diverso")
+        if self.dim is not None and vectors.shape[1] != self.dim:
+            raise ValueError(f"Dimensione embedding {vectors.shape[1]} diversa da quella dello store ({self.dim})")
+
+        keys = [self.key(text) for text in texts]
+        with self._lock:
+            index = self._ensure_positions()
+            rows = []
+            seen = set()
+            for i, k in enumerate(keys):
+                if k not in index and k not in seen:
+                    seen.add(k)
+                    rows.append(i)
+            if not rows:
+                return
+            new_keys = [keys[i] for i in rows]
+            self._register(self._write_segment(new_keys, vectors[rows]), new_keys)
+            self._merge_tail()
+
+    def _write_segment(self, keys: List[str], vectors: np.ndarray) -> Dict:
+        segments_dir = self._path(self.SEGMENTS_DIR)
+        os.makedirs(segments_dir, exist_ok=True)
+        name = hashlib.sha256("".join(keys).encode('utf-8')).hexdigest()[:16]
+        base = os.path.join(segments_dir, name)
+        with open(base + ".npy.tmp", 'wb') as f:
+            np.save(f, np.ascontiguousarray(vectors, dtype=np.float32))
+        os.replace(base + ".npy.tmp", base + ".npy")
+        # Il file json viene scritto per ultimo: la sua presenza indica un segmento completo
+        with open(base + ".json.tmp", 'w', encoding='utf-8') as f:
+            json.dump({'version': self.STORE_VERSION, 'model': self.model_name, 'keys': keys}, f)
+        os.replace(base + ".json.tmp", base + ".json")
+        return {'name': name, 'rows': len(keys)}
+
+    def _register(self, segment: Dict, keys: Optional[List[str]] = None):
+        # Il manifest (piccolo: solo nomi e righe dei segmenti) è l'unico file riscritto ad ogni aggiunta
+        row = self.rows
+        for k in keys if keys is not None else self._keys_of(segment['name']):
+            self._positions.setdefault(k, row)
+            row += 1
+        block = np.load(self._path(self.SEGMENTS_DIR, segment['name'] + ".npy"), mmap_mode='r')
+        self.segments = self.segments + [segment]
+        self._set_blocks(self._blocks + [block])
+        self._save_manifest()
+
+    def _save_manifest(self):
+        manifest_path = self._path(self.MANIFEST_FILE)
+        with open(manifest_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'version': self.STORE_VERSION, 'model': self.model_name,
+                       'dim': self.dim, 'segments': self.segments}, f)
+        os.replace(manifest_path + ".tmp", manifest_path)
+
+    def _merge_tail(self):
+        # Ogni segmento resta più grande di quello successivo: i segmenti sono O(log N)
+        # e ogni riga viene riscritta al più O(log N) volte, mai l'intera matrice ad ogni aggiunta
+        while len(self.segments) > 1 and self.segments[-2]['rows'] <= self.segments[-1]['rows']:
+            tail = self.segments[-2:]
+            keys = self._keys_of(tail[0]['name']) + self._keys_of(tail[1]['name'])
+            merged = self._write_segment(keys, np.concatenate([np.asarray(b) for b in self._blocks[-2:]]))
+            block = np.load(self._path(self.SEGMENTS_DIR, merged['name'] + ".npy"), mmap_mode='r')
+            self.segments = self.segments[:-2] + [merged]
+            self._set_blocks(self._blocks[:-2] + [block])
+            self._save_manifest()
+            for seg in tail:
+                if seg['name'] != merged['name']:
+                    self._remove_segment_files(seg['name'])
+
+    def _remove_segment_files(self, name: str):
+        for ext in (".json", ".npy"):
+            path = self._path(self.SEGMENTS_DIR, name + ext)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def compact(self):
+        # Segmenti completi presenti su disco ma assenti dal manifest (interruzione tra scrittura e registrazione)
+        segments_dir = self._path(self.SEGMENTS_DIR)
+        if not os.path.isdir(segments_dir):
+            return
+
+        with self._lock:
+            registered = {seg['name'] for seg in self.segments}
+            orphans = [name[:-len(".json")] for name in sorted(os.listdir(segments_dir))
+                       if name.endswith(".json") and name[:-len(".json")] not in registered]
+            if not orphans:
+                return
+
+            index = self._ensure_positions()
+            recovered = 0
+            for name in orphans:
+                try:
+                    with open(os.path.join(segments_dir, name + ".json"), 'r', encoding='utf-8') as f:
+                        meta = json.load(f)
+                    block = np.load(os.path.join(segments_dir, name + ".npy"))
+                except (OSError, ValueError) as e:
+                    print(f"Segmento embedding {name} illeggibile ({e}), ignorato")
+                    continue
+                self._remove_segment_files(name)
+                if meta.get('version') != self.STORE_VERSION or meta.get('model') != self.model_name:
+                    continue
+                if block.ndim != 2 or block.shape[0] != len(meta['keys']):
+                    continue
+                if (self.dim or block.shape[1]) != block.shape[1]:
+                    continue
+                rows = [i for i, k in enumerate(meta['keys']) if k not in index]
+                if rows:
+                    self.dim = self.dim or int(block.shape[1])
+                    keys = [meta['keys'][i] for i in rows]
+                    self._register(self._write_segment(keys, block[rows]), keys)
+                    recovered += len(rows)
+            self._merge_tail()
+            if recovered:
+                print(f"Recuperati {recovered} embedding da segmenti non registrati")
@@ -1,101 +1,379 @@
+import re
 import os
-import pickle
 import numpy as np
-from typing import List, Dict
-from azure.ai.inference import EmbeddingsClient
-from azure.core.credentials import AzureKeyCredential
+from typing import List, Dict, Optional
 from dotenv import load_dotenv
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from SingleFlight import SingleFlight
+from EmbeddingStore import EmbeddingStore
+from BulkEmbedder import BulkEmbedder
+from QueryEmbeddingCache import QueryEmbeddingCache
+from AnnIndex import IVFIndex
+from LexicalIndex import LexicalIndex
+from EmbeddingBackend import AzureEmbeddingBackend
+from Tracer import tracer
 
 load_dotenv()
 
 class FewShotSelector:
+    # Quota di slot vuoti oltre la quale remove_examples compatta il banco
+    COMPACT_RATIO = 0.25
+    # Domande per blocco nel calcolo semantico sui candidati ANN (limita la matrice domande x candidati x dim)
+    ANN_GATHER_ROWS = 32
+
     def __init__(self, ground_truth_examples: List[Dict[str, str]],
-                 token: str,
+                 token: str = None,
                  model_name: str = "cohere-embed-v3-multilingual",
-                 cache_file: str = "tesi_embeddings_cache.pkl"):
-        
-        self.examples = ground_truth_examples
-        self.model_name = model_name
-        self.cache_file = cache_file
+                 backend=None,
+                 store_dir: str = "tesi_embeddings_store",
+                 coalesce_window: float = 5.0,
+                 embed_chunk_size: int = 96,
+                 embed_workers: int = 4,
+                 embed_rps: float = 5.0,
+                 query_cache_size: int = 1024,
+                 index_type: str = "exact",
+                 ann_candidates: int = 256,
+                 n_probe: int = 8):
         
-        if not token:
-            raise ValueError("Token di accesso non fornito al FewShotSelector")
-            
-        self.client = EmbeddingsClient(
-            endpoint="https://models.inference.ai.azure.com",
-            credential=AzureKeyCredential(token)
-        )
+        # Backend di embedding: remoto (Azure) di default, oppure locale passato dalla pipeline
+        self.backend = backend or AzureEmbeddingBackend(token, model_name=model_name)
+        self.model_name = self.backend.name
+        # Uno store per backend: cambiare backend non invalida gli embedding già calcolati con l'altro
+        self.store_dir = os.path.join(store_dir, re.sub(r'[^\w.-]', '_', self.model_name))
+        self.embed_chunk_size = min(embed_chunk_size, self.backend.max_batch_size)
+        self.embed_workers = embed_workers
+        # I backend locali non hanno limiti di richieste
+        self.embed_rps = embed_rps if self.backend.requests_per_second else 0.0
+        self.ann_candidates = ann_candidates
+
+        if index_type not in ("exact", "ivf"):
+            raise ValueError(f"Tipo di indice non supportato: {index_type}")
+        self.index_type = index_type
+
+        # Embedding identici richiesti in contemporanea condividono una sola chiamata
+        self.flight = SingleFlight(window=coalesce_window)
         
-        #Load/salvataggio in cache dedicata per non sprecare chiamate
-        cache_loaded = False
-        if os.path.exists(self.cache_file):
-            print(f"Tentativo di caricamento cache locale ({self.cache_file})")
-            try:
-                with open(self.cache_file, 'rb') as f:
-                    self.example_embeddings = pickle.load(f)
-                cache_loaded = True
-                print("Cache caricata con successo!")
-            except (EOFError, pickle.UnpicklingError) as e:
-                print(f"ache corrotta o vuota ({e}). Ricalcolo")
-                cache_loaded = False
-
-        #Ricacolo degli embedding tramite choere
-        if not cache_loaded:
-            print(f"Calcolo embedding di {len(self.examples)} esempi tramite API ({self.model_name}).")
-            self.example_embeddings = self._batch_embed([ex["question"] for ex in self.examples])
-            
-            # Salva i risultati in un file locale per la prossima volta
-            with open(self.cache_file, 'wb') as f:
-                pickle.dump(self.example_embeddings, f)
-            print("Embedding salvati in cache! Le prossime esecuzioni saranno immediate.")
-
-        #Uso di TF-IDF
-        print("Indicizzazione Lessicale (TF-IDF)")
-        self.tfidf_vectorizer = TfidfVectorizer()
-        # Creiamo la matrice matematica delle parole esatte per tutti gli esempi
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform([ex["question"] for ex in self.examples])
+        # Store versionato: chiave = hash(modello + testo), si calcolano solo gli esempi nuovi o modificati
+        self.store = EmbeddingStore(self.store_dir, self.model_name)
+        # Cache delle domande utente: le domande ripetute non rifanno la chiamata di embedding
+        self.query_cache = QueryEmbeddingCache(os.path.join(self.store_dir, "queries"), self.model_name,
+                                               max_entries=query_cache_size)
+
+        # Gli esempi occupano slot stabili: le rimozioni lasciano uno slot vuoto, le aggiunte vanno in coda
+        self.examples: List[Optional[Dict[str, str]]] = []
+        self.slot_by_id: Dict[str, int] = {}
+        self.alive = np.zeros(0, dtype=bool)
+        # Embedding degli esempi pre-normalizzati in float32: il coseno diventa un semplice prodotto.
+        # La matrice ha capacità maggiore del numero di slot e cresce per raddoppio
+        self._unit = np.zeros((0, 0), dtype=np.float32)
+        self._missing_embeddings = 0
+
+        # Indice lessicale BM25 aggiornabile in modo incrementale
+        self.lexical_index = LexicalIndex()
+        # Indice approssimato per banchi molto grandi
+        self.ivf_index = IVFIndex(n_probe=n_probe) if self.index_type == "ivf" else None
+
+        print(f"Indicizzazione di {len(ground_truth_examples)} esempi (BM25{' + IVF' if self.ivf_index else ''})")
+        self.add_examples(ground_truth_examples)
+
+    @property
+    def size(self) -> int:
+        return len(self.examples)
+
+    @property
+    def unit_embeddings(self) -> np.ndarray:
+        return self._unit[:self.size]
+
+    @property
+    def semantic_enabled(self) -> bool:
+        # Se anche un solo esempio non ha embedding il punteggio semantico viene disattivato
+        return self._missing_embeddings == 0
+
+    def add_examples(self, examples: List[Dict[str, str]]):
+        # Id ripetuti nello stesso blocco: vale l'ultima occorrenza (nessuno slot orfano)
+        latest = {}
+        for pos, ex in enumerate(examples):
+            latest[('id', str(ex['id'])) if 'id' in ex else ('pos', pos)] = ex
+        examples = list(latest.values())
+
+        # Un esempio con id già presente sostituisce quello vecchio
+        replaced = [str(ex['id']) for ex in examples if 'id' in ex and str(ex['id']) in self.slot_by_id]
+        if replaced:
+            self.remove_examples(replaced)
+        if not examples:
+            return
+
+        vectors = self._normalize_rows(self._load_example_embeddings([ex["question"] for ex in examples]))
+        first = self.size
+        slots = np.arange(first, first + len(examples))
+        self._reserve(first + len(examples), vectors.shape[1])
+
+        self._unit[slots] = vectors
+        self.alive[slots] = True
+        valid = vectors.any(axis=1)
+        self._missing_embeddings += int((~valid).sum())
+        for slot, ex in zip(slots.tolist(), examples):
+            self.examples.append(ex)
+            if 'id' in ex:
+                self.slot_by_id[str(ex['id'])] = slot
+            self.lexical_index.add(slot, ex["question"])
+        if self.ivf_index is not None:
+            self.ivf_index.add(slots[valid], vectors[valid])
+
+    def remove_examples(self, example_ids: List[str]):
+        slots = []
+        for ex_id in example_ids:
+            slot = self.slot_by_id.pop(str(ex_id), None)
+            if slot is None:
+                continue
+            slots.append(slot)
+            if not self._unit[slot].any():
+                self._missing_embeddings -= 1
+            self.examples[slot] = None
+            self.alive[slot] = False
+            self._unit[slot] = 0
+            self.lexical_index.remove(slot)
+        if self.ivf_index is not None and slots:
+            self.ivf_index.remove(slots)
+        # Gli slot vuoti costano nel punteggio esatto: oltre una certa quota vengono recuperati
+        if self.size - int(self.alive[:self.size].sum()) > self.COMPACT_RATIO * self.size:
+            self.compact()
+
+    def compact(self):
+        # Slot vivi riportati in testa, nello stesso ordine; gli indici vengono rinumerati, non ricostruiti
+        keep = np.flatnonzero(self.alive[:self.size])
+        if len(keep) == self.size:
+            return
+        mapping = np.full(self.size, -1, dtype=np.int64)
+        mapping[keep] = np.arange(len(keep))
+
+        self._unit[:len(keep)] = self._unit[keep]
+        self._unit[len(keep):self.size] = 0
+        self.alive[:self.size] = False
+        self.alive[:len(keep)] = True
+        self.examples = [self.examples[slot] for slot in keep.tolist()]
+        self.slot_by_id = {ex_id: int(mapping[slot]) for ex_id, slot in self.slot_by_id.items()}
+        self.lexical_index.remap(mapping)
+        if self.ivf_index is not None:
+            self.ivf_index.remap(mapping)
+
+    def _reserve(self, n_slots: int, dim: int):
+        if self._unit.shape[1] == 0:
+            self._unit = np.zeros((0, dim), dtype=np.float32)
+        if dim != self._unit.shape[1]:
+            raise ValueError(f"Dimensione embedding {dim} diversa da quella del selettore ({self._unit.shape[1]})")
+        capacity = len(self._unit)
+        if n_slots <= capacity:
+            return
+        # Crescita per raddoppio: il costo delle aggiunte resta ammortizzato costante
+        new_capacity = max(n_slots, 2 * capacity)
+        unit = np.zeros((new_capacity, dim), dtype=np.float32)
+        unit[:capacity] = self._unit
+        alive = np.zeros(new_capacity, dtype=bool)
+        alive[:capacity] = self.alive
+        self._unit, self.alive = unit, alive
+
+    def _load_example_embeddings(self, texts: List[str]) -> np.ndarray:
+        # Blocchi di dimensione compatibile col provider, calcolati in parallelo e salvati man mano:
+        # se l'indicizzazione si interrompe, il prossimo avvio riparte dai blocchi mancanti
+        embedder = BulkEmbedder(self._embed, self.store,
+                                chunk_size=self.embed_chunk_size,
+                                max_workers=self.embed_workers,
+                                requests_per_second=self.embed_rps)
+        vectors, missing = embedder.embed_all(texts)
+
+        if vectors is None:
+            vectors = np.zeros((len(texts), self.backend.dim), dtype=np.float32)
+        if missing:
+            # Gli embedding falliti non vengono mai salvati: al prossimo avvio si riprova
+            print(f"Attenzione: {len(missing)} esempi senza embedding, verranno ricalcolati al prossimo avvio")
+        else:
+            print(f"Embedding di {len(texts)} esempi pronti ({self.store_dir})")
+        return vectors
 
     def _batch_embed(self, texts: List[str]) -> np.ndarray:
+        key = SingleFlight.fingerprint(self.model_name, texts)
         try:
-            response = self.client.embed(input=texts, model=self.model_name)
-            return np.array([item.embedding for item in response.data])
+            return self.flight.do(key, lambda: self._embed(texts))
         except Exception as e:
             print(f"Errore durante il calcolo degli embedding: {e}")
             # Ritorna array vuoti in caso di fallimento per non far crashare lo script
-            return np.zeros((len(texts), 1024))
+            return np.zeros((len(texts), self.backend.dim))
+
+    def _embed(self, texts: List[str]) -> np.ndarray:
+        # Lo stesso array viene consegnato a tutti i chiamanti coalizzati: in sola lettura
+        vectors = np.asarray(self.backend.embed(texts))
+        vectors.flags.writeable = False
+        return vectors
+
+    def _embed_questions(self, questions: List[str]) -> np.ndarray:
+        # Si calcola l'embedding del testo normalizzato, lo stesso usato come chiave della cache
+        questions = [self.query_cache.normalize(q) for q in questions]
+        vectors: List[np.ndarray] = [self.query_cache.get(q) for q in questions]
+        pending = list(dict.fromkeys(q for q, v in zip(questions, vectors) if v is None))
+
+        # Le domande non in cache vengono calcolate insieme, in blocchi compatibili col provider
+        computed = {}
+        for i in range(0, len(pending), self.embed_chunk_size):
+            chunk = pending[i:i + self.embed_chunk_size]
+            for q, vec in zip(chunk, self._batch_embed(chunk)):
+                computed[q] = vec
+                # Un vettore nullo indica una chiamata fallita: non va messo in cache
+                if np.any(vec):
+                    self.query_cache.put(q, vec)
+
+        dim = self._unit.shape[1]
+        matrix = np.zeros((len(questions), dim), dtype=np.float32)
+        for i, (q, vec) in enumerate(zip(questions, vectors)):
+            vec = computed[q] if vec is None else vec
+            if len(vec) == dim:
+                matrix[i] = vec
+        return matrix
+
+    def embed_question(self, user_question: str) -> np.ndarray:
+        return self._normalize_rows(self._embed_questions([user_question]))[0]
+
+    @staticmethod
+    def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+        matrix = np.asarray(matrix, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        return np.divide(matrix, norms, out=np.zeros_like(matrix), where=norms > 0)
+
+    @staticmethod
+    def _min_max_rows(scores: np.ndarray, mins: Optional[np.ndarray] = None,
+                      mask: Optional[np.ndarray] = None) -> np.ndarray:
+        # Normalizzazione Min-Max (scala 0-1) riga per riga, considerando solo le colonne in mask
+        if mask is None:
+            mask = np.ones(scores.shape[1], dtype=bool)
+        if mins is None:
+            mins = scores.min(axis=1, keepdims=True, initial=np.inf, where=mask)
+        ranges = scores.max(axis=1, keepdims=True, initial=-np.inf, where=mask) - mins
+        return np.where(ranges > 0, (scores - mins) / np.where(ranges > 0, ranges, 1), scores)
 
     def select_top_k(self, user_question: str, k: int, alpha: float = 0.5) -> List[Dict[str, str]]:
+        return self.select_top_k_batch([user_question], k, alpha)[0]
 
-        user_vec = self._batch_embed([user_question])[0]
-        
-        norm_user = np.linalg.norm(user_vec)
-        norms_examples = np.linalg.norm(self.example_embeddings, axis=1)
-        
-        if norm_user == 0 or np.any(norms_examples == 0):
-            semantic_scores = np.zeros(len(self.examples))
-        else:
-            semantic_scores = np.dot(self.example_embeddings, user_vec) / (norms_examples * norm_user)
+    def select_top_k_batch(self, user_questions: List[str], k: int, alpha: float = 0.5,
+                           block_size: int = 1024) -> List[List[Dict[str, str]]]:
+        top = self._top_k_indices(user_questions, k, alpha, block_size, use_ann=self.index_type == "ivf")
+        return [[self.examples[i] for i in row] for row in top]
 
-        # Normalizzazione Min-Max (scala 0-1) per il punteggio semantico
-        sem_min, sem_max = semantic_scores.min(), semantic_scores.max()
-        if sem_max > sem_min:
-            semantic_scores = (semantic_scores - sem_min) / (sem_max - sem_min)
-            
-        
-        user_tfidf = self.tfidf_vectorizer.transform([user_question])
-        lexical_scores = cosine_similarity(user_tfidf, self.tfidf_matrix).flatten()
-        
-        # Normalizzazione Min-Max (scala 0-1) per il punteggio lessicale
-        lex_min, lex_max = lexical_scores.min(), lexical_scores.max()
-        if lex_max > lex_min:
-            lexical_scores = (lexical_scores - lex_min) / (lex_max - lex_min)
+    def measure_recall(self, user_questions: List[str], k: int, alpha: float = 0.5) -> float:
+        # Frazione dei top-k esatti ritrovati dall'indice approssimato
+        if self.index_type != "ivf":
+            return 1.0
+        exact = self._top_k_indices(user_questions, k, alpha, use_ann=False)
+        approx = self._top_k_indices(user_questions, k, alpha, use_ann=True)
+        found = sum(len(np.intersect1d(e, a)) for e, a in zip(exact, approx))
+        total = sum(len(e) for e in exact)
+        return found / total if total else 1.0
+
+    def _top_k_indices(self, user_questions: List[str], k: int, alpha: float,
+                       block_size: int = 1024, use_ann: bool = False) -> List[np.ndarray]:
+        k = min(k, int(self.alive[:self.size].sum()))
+        if not user_questions or k <= 0:
+            return [np.empty(0, dtype=np.int64) for _ in user_questions]
+
+        with tracer.span('embedding', questions=len(user_questions)):
+            user_vecs = self._normalize_rows(self._embed_questions(user_questions))
+        selections = []
+
+        # Blocchi di domande per tenere limitata la matrice dei punteggi (domande x esempi)
+        with tracer.span('few_shot_scoring', questions=len(user_questions), examples=self.size,
+                         index=self.index_type):
+            for start in range(0, len(user_questions), block_size):
+                vecs = user_vecs[start:start + block_size]
+                questions = user_questions[start:start + block_size]
+                if use_ann:
+                    selections.extend(self._select_ann(vecs, questions, k, alpha))
+                else:
+                    selections.extend(self._select_exact(vecs, questions, k, alpha))
+
+        return selections
+
+    def _select_exact(self, vecs: np.ndarray, questions: List[str], k: int, alpha: float) -> List[np.ndarray]:
+        alive = self.alive[:self.size]
+
+        # Punteggio semantico: un solo prodotto matriciale su vettori già normalizzati
+        semantic_scores = vecs @ self.unit_embeddings.T
+        if not self.semantic_enabled:
+            semantic_scores[:] = 0
+        # Domande senza embedding (chiamata fallita) non contribuiscono al punteggio semantico
+        semantic_scores[~vecs.any(axis=1)] = 0
+        semantic_scores = self._min_max_rows(semantic_scores, mask=alive)
 
-        #Somma punteggi ottenuti
+        # Punteggio lessicale BM25 per tutte le domande del blocco
+        lexical_scores = self._min_max_rows(self.lexical_index.score_batch(questions, self.size), mask=alive)
+
+        #Somma punteggi ottenuti, gli slot rimossi non possono essere selezionati
         hybrid_scores = (alpha * semantic_scores) + ((1.0 - alpha) * lexical_scores)
-        
-        # Ordiniamo gli indici in base al punteggio decrescente e prendiamo i primi k
-        top_indices = np.argsort(hybrid_scores)[::-1][:k]
-        
-        return [self.examples[i] for i in top_indices]
\ No newline at end of file
+        hybrid_scores[:, ~alive] = -np.inf
+        return list(self._top_k_rows(hybrid_scores, k))
+
+    def _select_ann(self, vecs: np.ndarray, questions: List[str], k: int, alpha: float) -> List[np.ndarray]:
+        # Tutto il blocco di domande insieme: candidati come matrice (domande x candidati), -1 dove mancano
+        n_candidates = self.ann_candidates
+        use_semantic = vecs.any(axis=1) & self.semantic_enabled
+
+        # Unione dei candidati lessicali (indice invertito, liste dei termini frequenti troncate) e semantici (IVF)
+        lexical = self.lexical_index.score_sparse(questions, self.size, max_postings=n_candidates)
+        candidates = np.concatenate([self._top_sparse_rows(lexical, n_candidates),
+                                     np.where(use_semantic[:, np.newaxis],
+                                              self.ivf_index.search(vecs, n_candidates), -1)], axis=1)
+        candidates.sort(axis=1)
+        candidates[:, 1:][candidates[:, 1:] == candidates[:, :-1]] = -1
+        # Domande senza candidati: i primi esempi del banco
+        empty = ~(candidates >= 0).any(axis=1)
+        if empty.any():
+            fallback = np.full(candidates.shape[1], -1, dtype=np.int64)
+            first = np.flatnonzero(self.alive[:self.size])[:candidates.shape[1]]
+            fallback[:len(first)] = first
+            candidates[empty] = fallback
+        valid = candidates >= 0
+        safe = np.where(valid, candidates, 0)
+
+        # Il blending ibrido viene applicato solo sui candidati. I massimi stanno tra i candidati,
+        # i minimi vanno stimati sull'intero banco per restare coerenti con la ricerca esatta
+        semantic_scores = np.zeros(candidates.shape, dtype=np.float32)
+        for start in range(0, len(vecs), self.ANN_GATHER_ROWS):
+            rows = slice(start, start + self.ANN_GATHER_ROWS)
+            semantic_scores[rows] = np.einsum('qcd,qd->qc', self._unit[safe[rows]], vecs[rows])
+        semantic_min = np.minimum(self.ivf_index.min_score_estimate(vecs),
+                                  semantic_scores.min(axis=1, initial=np.inf, where=valid))
+        semantic_scores = self._min_max_rows(semantic_scores, semantic_min[:, np.newaxis], mask=valid)
+        semantic_scores[~use_semantic] = 0
+
+        # Nei banchi grandi c'è sempre almeno un esempio senza termini in comune: il minimo lessicale è 0
+        lexical_scores = self.lexical_index.score_candidates(questions, candidates)
+        lexical_scores = self._min_max_rows(lexical_scores, np.zeros((len(vecs), 1), dtype=np.float32), mask=valid)
+
+        hybrid_scores = (alpha * semantic_scores) + ((1.0 - alpha) * lexical_scores)
+        hybrid_scores[~valid] = -np.inf
+        top = self._top_k_rows(hybrid_scores, min(k, candidates.shape[1]))
+        selected = np.take_along_axis(candidates, top, axis=1)
+        return [row[row >= 0] for row in selected]
+
+    @staticmethod
+    def _top_sparse_rows(scores, n: int) -> np.ndarray:
+        # Primi n id per riga di una matrice CSR, come matrice (righe x n) con -1 dove mancano
+        counts = np.diff(scores.indptr)
+        width = int(counts.max(initial=0))
+        row_of = np.repeat(np.arange(scores.shape[0]), counts)
+        position = np.arange(scores.nnz) - scores.indptr[row_of]
+        padded = np.full((scores.shape[0], width), -np.inf, dtype=np.float32)
+        ids = np.full((scores.shape[0], width), -1, dtype=np.int64)
+        padded[row_of, position] = scores.data
+        ids[row_of, position] = scores.indices
+        if width > n:
+            top = np.argpartition(-padded, n - 1, axis=1)[:, :n]
+            ids = np.take_along_axis(ids, top, axis=1)
+        return ids
+
+    @staticmethod
+    def _top_k_rows(scores: np.ndarray, k: int) -> np.ndarray:
+        # Selezione parziale dei primi k, poi ordinamento solo di quei k
+        if k < scores.shape[1]:
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        else:
+            top = np.tile(np.arange(scores.shape[1]), (scores.shape[0], 1))
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        return np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind='stable'), axis=1)
@@ -0,0 +1,74 @@
+import os
+import json
+import hashlib
+import threading
+from typing import Any, Dict, List
+
+class JsonlCheckpoint:
+    # Checkpoint append-only in JSONL: una riga per elemento completato.
+    # La prima riga contiene la firma della run: se la configurazione cambia il checkpoint riparte da zero.
+    # Con fresh=True il checkpoint esistente viene scartato e la run riparte comunque da zero
+    def __init__(self, path: str, signature: Any, id_field: str = 'id', fresh: bool = False):
+        self.path = path
+        self.id_field = id_field
+        self.signature = hashlib.sha256(
+            json.dumps(signature, sort_keys=True, ensure_ascii=False, default=str).encode('utf-8')
+        ).hexdigest()
+        self._lock = threading.Lock()
+        self.records: Dict[str, Dict] = {}
+        self._load(fresh)
+
+    def _load(self, fresh: bool):
+        if fresh:
+            if os.path.exists(self.path):
+                print(f"Checkpoint {self.path} scartato: run da zero")
+        elif os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                lines = f.read().splitlines()
+            meta = self._parse(lines[0]) if lines else None
+            if meta and meta.get('_signature') == self.signature:
+                for line in lines[1:]:
+                    record = self._parse(line)
+                    # Un'ultima riga troncata (crash durante la scrittura) viene semplicemente ignorata
+                    if record is not None and self.id_field in record:
+                        self.records[str(record[self.id_field])] = record
+                if self.records:
+                    print(f"Checkpoint trovato ({self.path}): {len(self.records)} elementi già completati")
+                # Riscrive il file senza eventuali righe troncate
+                self._rewrite()
+                return
+            print(f"Checkpoint {self.path} appartiene a una run diversa, si riparte da zero")
+        self._rewrite()
+
+    @staticmethod
+    def _parse(line: str):
+        try:
+            return json.loads(line)
+        except json.JSONDecodeError:
+            return None
+
+    def _rewrite(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'_signature': self.signature}) + "\n")
+            for record in self.records.values():
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def is_done(self, item_id: Any) -> bool:
+        return str(item_id) in self.records
+
+    def append(self, record: Dict):
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self.records[str(record[self.id_field])] = record
+
+    def ordered(self, ids: List[Any]) -> List[Dict]:
+        # Record nell'ordine richiesto, saltando quelli non ancora completati
+        return [self.records[str(i)] for i in ids if str(i) in self.records]
@@ -4,11 +4,16 @@ from dotenv import load_dotenv
 from azure.ai.inference import ChatCompletionsClient
 from azure.ai.inference.models import SystemMessage, UserMessage, ChatRequestMessage
 from azure.core.credentials import AzureKeyCredential
+from PromptBuilder import PromptBuilder
+from SingleFlight import SingleFlight
+from Tracer import tracer
 
 load_dotenv()
 
 class LLMClient:
-    def __init__(self, model_name: str, token: str):
+    ERROR_MESSAGE = "Errore nella generazione della query."
+
+    def __init__(self, model_name: str, token: str, coalesce_window: float = 5.0):
         self.model_name = model_name
         self.token = token # Usa il token passato dalla pipeline
         
@@ -21,46 +26,41 @@ class LLMClient:
             connection_timeout=10,
             read_timeout=30
         )
+        # Richieste identiche in volo condividono una sola chiamata al modello
+        self.flight = SingleFlight(window=coalesce_window)
 
     def generate_query(self, 
-                       instructions_path: str, 
-                       schema_context: str,
+                       prompt: PromptBuilder,
                        few_shot_examples: List[Dict[str, str]], 
                        user_question: str) -> str:
         
-        # Lettura istruzioni come testo puro
-        with open(instructions_path, 'r', encoding='utf-8') as f:
-            system_instructions = f.read().strip()
-
-        # Creazione del testo degli esempi
-        examples_text = ""
-        if few_shot_examples:
-            examples_text = "\n\nESEMPI DI QUERY (FEW-SHOT)\n"
-            examples_text += "Usa QUESTI esempi come modello assoluto per la logica e i nomi delle proprietà.\n"
-            for i, ex in enumerate(few_shot_examples, 1):
-                examples_text += f"\nDomanda Utente: {ex['question']}\nQuery Attesa:\n{ex['query']}\n"
-
-        # Creazione del prompt finale
-        full_system_content = f"{system_instructions}\n\nDATABASE SCHEMA\n{schema_context}{examples_text}"
+        # Prefisso statico nel system, esempi e domanda in coda
+        system_content, user_content = prompt.build(few_shot_examples, user_question)
         
         messages: List[ChatRequestMessage] = [
-            SystemMessage(content=full_system_content),
-            UserMessage(content=user_question)
+            SystemMessage(content=system_content),
+            UserMessage(content=user_content)
         ]
+        key = SingleFlight.fingerprint(self.model_name, system_content, user_content)
         
-        try:
-            response = self.client.complete(
-                messages=messages,
-                temperature=0.0,
-                model=self.model_name
-            )
-            query = response.choices[0].message.content.strip()
-            
-            # Pulizia automatica markdown
-            if query.startswith("```"):
-                lines = query.splitlines()
-                if len(lines) >= 3: query = "\n".join(lines[1:-1])
-            return query.strip()
-        except Exception as e:
-            print(f"Errore API: {e}")
-            return "Errore nella generazione della query."
\ No newline at end of file
+        with tracer.span('llm_generation', model=self.model_name) as span:
+            try:
+                return self.flight.do(key, lambda: self._complete(messages))
+            except Exception as e:
+                print(f"Errore API: {e}")
+                span['error'] = str(e)
+                return self.ERROR_MESSAGE
+
+    def _complete(self, messages: List[ChatRequestMessage]) -> str:
+        response = self.client.complete(
+            messages=messages,
+            temperature=0.0,
+            model=self.model_name
+        )
+        query = response.choices[0].message.content.strip()
+        
+        # Pulizia automatica markdown
+        if query.startswith("```"):
+            lines = query.splitlines()
+            if len(lines) >= 3: query = "\n".join(lines[1:-1])
+        return query.strip()
\ No newline at end of file
@@ -0,0 +1,184 @@
+import re
+import numpy as np
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+class LexicalIndex:
+    # Indice invertito BM25 aggiornabile in modo incrementale: aggiungere o rimuovere un esempio
+    # tocca solo i posting dei suoi termini, senza ricostruire l'intero indice
+    TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_terms: Dict[int, Counter] = {}
+        self.doc_len = np.zeros(0, dtype=np.float32)
+        self.total_len = 0
+        # Cache degli array numpy per termine, invalidata quando il termine cambia
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        # Liste troncate dei termini frequenti, valide finché numero e lunghezza degli esempi non cambiano
+        self._top: Dict[str, Tuple[Tuple[int, int, int], np.ndarray, np.ndarray]] = {}
+        # Frequenze dei termini presenti in molti esempi come vettore denso per slot (vedi _term_dense)
+        self._dense: Dict[str, np.ndarray] = {}
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        return cls.TOKEN_PATTERN.findall(text.lower())
+
+    def __len__(self) -> int:
+        return len(self.doc_terms)
+
+    def add(self, slot: int, text: str):
+        if slot in self.doc_terms:
+            self.remove(slot)
+        terms = Counter(self.tokenize(text))
+        self.doc_terms[slot] = terms
+
+        if slot >= len(self.doc_len):
+            grown = np.zeros(max(slot + 1, 2 * len(self.doc_len)), dtype=np.float32)
+            grown[:len(self.doc_len)] = self.doc_len
+            self.doc_len = grown
+        length = sum(terms.values())
+        self.doc_len[slot] = length
+        self.total_len += length
+
+        for term, tf in terms.items():
+            self.postings.setdefault(term, {})[slot] = tf
+            self._arrays.pop(term, None)
+            self._top.pop(term, None)
+            self._dense.pop(term, None)
+
+    def remove(self, slot: int):
+        terms = self.doc_terms.pop(slot, None)
+        if terms is None:
+            return
+        self.total_len -= int(self.doc_len[slot])
+        self.doc_len[slot] = 0
+        for term in terms:
+            posting = self.postings[term]
+            del posting[slot]
+            if not posting:
+                del self.postings[term]
+            self._arrays.pop(term, None)
+            self._top.pop(term, None)
+            self._dense.pop(term, None)
+
+    def remap(self, mapping: np.ndarray):
+        # Slot rinumerati dopo una compattazione: mapping[vecchio slot] = nuovo slot
+        self.postings = {term: {int(mapping[slot]): tf for slot, tf in posting.items()}
+                         for term, posting in self.postings.items()}
+        self.doc_terms = {int(mapping[slot]): terms for slot, terms in self.doc_terms.items()}
+        kept = np.flatnonzero(mapping >= 0)
+        doc_len = np.zeros_like(self.doc_len)
+        doc_len[mapping[kept]] = self.doc_len[kept]
+        self.doc_len = doc_len
+        self._arrays = {}
+        self._top = {}
+        self._dense = {}
+
+    def _term_arrays(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        # Slot in ordine crescente (ricerca binaria in score_candidates) e frequenze corrispondenti
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            posting = self.postings[term]
+            ids = np.fromiter(posting.keys(), dtype=np.int64, count=len(posting))
+            tfs = np.fromiter(posting.values(), dtype=np.float32, count=len(posting))
+            order = np.argsort(ids)
+            arrays = (ids[order], tfs[order])
+            self._arrays[term] = arrays
+        return arrays
+
+    def _term_dense(self, term: str) -> np.ndarray:
+        # Oltre un esempio su tre il vettore denso (4 byte per slot) non occupa più di ids + tf (12 byte per
+        # posting) e la frequenza di un candidato si legge per indice, senza ricerca binaria
+        dense = self._dense.get(term)
+        if dense is None or len(dense) != len(self.doc_len):
+            ids, tfs = self._term_arrays(term)
+            dense = np.zeros(len(self.doc_len), dtype=np.float32)
+            dense[ids] = tfs
+            self._dense[term] = dense
+        return dense
+
+    def _query_terms(self, questions: List[str]) -> Dict[str, Tuple[List[int], List[int]]]:
+        # Termine -> (domande che lo contengono, frequenza nella domanda); solo termini presenti nell'indice
+        terms: Dict[str, Tuple[List[int], List[int]]] = {}
+        for row, question in enumerate(questions):
+            for term, qtf in Counter(self.tokenize(question)).items():
+                if term in self.postings:
+                    rows, counts = terms.setdefault(term, ([], []))
+                    rows.append(row)
+                    counts.append(qtf)
+        return terms
+
+    def _bm25(self, term: str, ids: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        n_docs = len(self.doc_terms)
+        df = len(self.postings[term])
+        idf = np.log(1.0 + (n_docs - df + 0.5) / (df + 0.5))
+        avgdl = self.total_len / n_docs if n_docs else 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[ids] / max(avgdl, 1e-9))
+        return idf * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+    def _term_weights(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        ids, tfs = self._term_arrays(term)
+        return ids, self._bm25(term, ids, tfs)
+
+    def _top_weights(self, term: str, max_postings: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Termini frequenti (articoli, preposizioni): solo i max_postings esempi con peso maggiore, come nelle
+        # liste ordinate per impatto. Serve solo a generare i candidati: il loro punteggio viene poi
+        # ricalcolato su tutti i termini (score_candidates). Calcolato una volta finché l'indice non cambia
+        stats = (len(self.doc_terms), self.total_len, max_postings)
+        cached = self._top.get(term)
+        if cached is not None and cached[0] == stats:
+            return cached[1], cached[2]
+        ids, weights = self._term_weights(term)
+        top = np.argpartition(-weights, max_postings - 1)[:max_postings]
+        self._top[term] = (stats, ids[top], weights[top])
+        return ids[top], weights[top]
+
+    def score_sparse(self, questions: List[str], n_slots: int, max_postings: Optional[int] = None):
+        # Matrice sparsa CSR (domande x slot) da un solo prodotto sparso: domande x termini (frequenze)
+        # per termini x slot (pesi BM25). I pesi di ogni termine vengono calcolati una volta per blocco.
+        # Con max_postings le liste dei termini frequenti vengono troncate: il costo per domanda non cresce
+        # più con la dimensione del banco
+        from scipy.sparse import csr_matrix
+        vocabulary = self._query_terms(questions)
+        if not vocabulary:
+            return csr_matrix((len(questions), n_slots), dtype=np.float32)
+
+        rows = [row for term_rows, _ in vocabulary.values() for row in term_rows]
+        columns = [column for column, (term_rows, _) in enumerate(vocabulary.values()) for _ in term_rows]
+        counts = [qtf for _, term_counts in vocabulary.values() for qtf in term_counts]
+        query = csr_matrix((np.asarray(counts, dtype=np.float32), (rows, columns)),
+                           shape=(len(questions), len(vocabulary)))
+        postings = [self._top_weights(term, max_postings)
+                    if max_postings is not None and len(self.postings[term]) > max_postings
+                    else self._term_weights(term) for term in vocabulary]
+        lengths = [len(ids) for ids, _ in postings]
+        weights = csr_matrix((np.concatenate([w for _, w in postings]).astype(np.float32),
+                              np.concatenate([ids for ids, _ in postings]),
+                              np.concatenate([[0], np.cumsum(lengths)])),
+                             shape=(len(vocabulary), n_slots))
+        return (query @ weights).tocsr()
+
+    def score_candidates(self, questions: List[str], candidates: np.ndarray) -> np.ndarray:
+        # BM25 esatto (tutti i termini, liste complete) per una matrice di candidati (domande x candidati,
+        # -1 dove mancano): per ogni termine del blocco i candidati vengono cercati nella sua lista
+        # (ricerca binaria) o letti dal vettore denso dei termini frequenti
+        scores = np.zeros(candidates.shape, dtype=np.float32)
+        for term, (rows, counts) in self._query_terms(questions).items():
+            term_candidates = candidates[rows]
+            valid = term_candidates >= 0
+            if 3 * len(self.postings[term]) > len(self.doc_len):
+                tfs = np.where(valid, self._term_dense(term)[term_candidates], 0)
+            else:
+                ids, term_tfs = self._term_arrays(term)
+                pos = np.minimum(np.searchsorted(ids, term_candidates), len(ids) - 1)
+                tfs = np.where(valid & (ids[pos] == term_candidates), term_tfs[pos], 0)
+            weights = self._bm25(term, np.where(valid, term_candidates, 0), tfs)
+            scores[rows] += np.asarray(counts, dtype=np.float32)[:, np.newaxis] * weights
+        return scores
+
+    def score_batch(self, questions: List[str], n_slots: int) -> np.ndarray:
+        # Matrice densa (domande x slot) con i punteggi esatti
+        return self.score_sparse(questions, n_slots).toarray().astype(np.float32, copy=False)
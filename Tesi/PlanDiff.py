@@ -0,0 +1,128 @@
+from collections import Counter
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+class PlanDiff:
+    # Analisi dei piani EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) e confronto GT vs LLM:
+    # scansioni sequenziali, nested loop che rieseguono cypher()/tabelle del grafo e stime di righe sbagliate
+    BLOWUP_RATIO = 10.0
+    # Sotto queste righe uno scarto di stima non è interessante
+    MIN_ROWS = 100
+
+    @staticmethod
+    def walk(plan: Dict) -> Iterator[Tuple[Dict, int]]:
+        # Visita iterativa dell'albero del piano: (nodo, profondità)
+        stack = [(plan.get('Plan', plan), 0)]
+        while stack:
+            node, depth = stack.pop()
+            yield node, depth
+            for child in reversed(node.get('Plans', [])):
+                stack.append((child, depth + 1))
+
+    @staticmethod
+    def _relation(node: Dict) -> str:
+        schema = node.get('Schema')
+        relation = node.get('Relation Name', node.get('Function Name', ''))
+        return f"{schema}.{relation}" if schema else relation
+
+    @staticmethod
+    def _touches_graph(node: Dict, graph_schema: str) -> bool:
+        # Chiamata cypher() non espansa dal planner o scansione di una tabella di label AGE
+        for child, _ in PlanDiff.walk({'Plan': node}):
+            if child.get('Node Type') == 'Function Scan' and child.get('Function Name') == 'cypher':
+                return True
+            if child.get('Schema') == graph_schema:
+                return True
+        return False
+
+    @staticmethod
+    def summarize(plan: Dict, graph_schema: str = 'agri_graph') -> Dict[str, Any]:
+        root = plan.get('Plan', plan)
+        node_types = Counter()
+        seq_scans: List[str] = []
+        graph_loops: List[Dict] = []
+        blowups: List[Dict] = []
+
+        for node, _ in PlanDiff.walk(plan):
+            node_type = node.get('Node Type', '')
+            node_types[node_type] += 1
+            if node_type == 'Seq Scan':
+                seq_scans.append(PlanDiff._relation(node))
+
+            # Lato interno di un nested loop rieseguito per ogni riga esterna
+            if node_type == 'Nested Loop' and len(node.get('Plans', [])) == 2:
+                inner = node['Plans'][1]
+                loops = inner.get('Actual Loops', 1)
+                if loops > 1 and PlanDiff._touches_graph(inner, graph_schema):
+                    graph_loops.append({
+                        'inner': inner.get('Node Type'),
+                        'relation': PlanDiff._relation(inner),
+                        'loops': loops
+                    })
+
+            if 'Actual Rows' in node:
+                loops = node.get('Actual Loops', 1) or 1
+                actual = node['Actual Rows'] * loops
+                estimated = node.get('Plan Rows', 0) * loops
+                ratio = max(actual, estimated) / max(min(actual, estimated), 1)
+                if ratio >= PlanDiff.BLOWUP_RATIO and max(actual, estimated) >= PlanDiff.MIN_ROWS:
+                    blowups.append({
+                        'node': node_type,
+                        'relation': PlanDiff._relation(node),
+                        'estimated_rows': estimated,
+                        'actual_rows': actual,
+                        'ratio': round(ratio, 1)
+                    })
+
+        return {
+            'execution_ms': plan.get('Execution Time'),
+            'planning_ms': plan.get('Planning Time'),
+            'total_cost': root.get('Total Cost'),
+            'actual_rows': root.get('Actual Rows'),
+            'shared_hit_blocks': root.get('Shared Hit Blocks'),
+            'shared_read_blocks': root.get('Shared Read Blocks'),
+            'node_types': dict(node_types),
+            'seq_scans': seq_scans,
+            'graph_nested_loops': graph_loops,
+            'row_blowups': blowups
+        }
+
+    @staticmethod
+    def diff(gt_plan: Dict, llm_plan: Dict, graph_schema: str = 'agri_graph') -> Dict[str, Any]:
+        gt = PlanDiff.summarize(gt_plan, graph_schema)
+        llm = PlanDiff.summarize(llm_plan, graph_schema)
+        findings: List[str] = []
+
+        slowdown: Optional[float] = None
+        if gt['execution_ms'] and llm['execution_ms'] is not None:
+            slowdown = round(llm['execution_ms'] / gt['execution_ms'], 2)
+            if slowdown >= 2:
+                findings.append(f"Esecuzione {slowdown}x più lenta della GT "
+                                f"({llm['execution_ms']:.1f} ms vs {gt['execution_ms']:.1f} ms)")
+
+        new_seq_scans = sorted((Counter(llm['seq_scans']) - Counter(gt['seq_scans'])).elements())
+        for relation in dict.fromkeys(new_seq_scans):
+            findings.append(f"Seq Scan su {relation} assente nel piano GT")
+
+        gt_loops = sum(loop['loops'] for loop in gt['graph_nested_loops'])
+        llm_loops = sum(loop['loops'] for loop in llm['graph_nested_loops'])
+        if llm_loops > gt_loops:
+            worst = max(llm['graph_nested_loops'], key=lambda loop: loop['loops'])
+            findings.append(f"Nested loop sul grafo: {worst['relation']} rieseguito {worst['loops']} volte "
+                            f"(GT: {gt_loops} riesecuzioni)")
+
+        gt_blowups = {(b['node'], b['relation']) for b in gt['row_blowups']}
+        for blowup in llm['row_blowups']:
+            if (blowup['node'], blowup['relation']) not in gt_blowups:
+                findings.append(f"Stima righe errata di {blowup['ratio']}x su {blowup['node']} {blowup['relation']} "
+                                f"(stimate {blowup['estimated_rows']}, reali {blowup['actual_rows']})")
+
+        node_types = Counter(llm['node_types'])
+        node_types.subtract(gt['node_types'])
+        return {
+            'slowdown': slowdown,
+            'new_seq_scans': new_seq_scans,
+            'node_type_delta': {k: v for k, v in node_types.items() if v},
+            'findings': findings,
+            'gt': gt,
+            'llm': llm
+        }
@@ -0,0 +1,60 @@
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+class PromptBuilder:
+    EXAMPLES_HEADER = (
+        "ESEMPI DI QUERY (FEW-SHOT)\n"
+        "Usa QUESTI esempi come modello assoluto per la logica e i nomi delle proprietà.\n"
+    )
+    QUESTION_HEADER = "DOMANDA UTENTE\n"
+
+    def __init__(self, instructions_path: str, schema_context: str):
+        # Le istruzioni vengono lette una sola volta, non ad ogni domanda
+        with open(instructions_path, 'r', encoding='utf-8') as f:
+            system_instructions = f.read().strip()
+
+        # Prefisso statico (istruzioni + schema): resta identico byte per byte tra le chiamate,
+        # così i provider con prompt caching possono riutilizzarlo
+        self.static_prefix = f"{system_instructions}\n\nDATABASE SCHEMA\n{schema_context}"
+        encoded = self.static_prefix.encode('utf-8')
+        self.prefix_bytes = len(encoded)
+        self.prefix_hash = hashlib.sha256(encoded).hexdigest()[:16]
+        # Versione dello schema: cambia solo se cambia la struttura del grafo
+        self.schema_hash = hashlib.sha256(schema_context.encode('utf-8')).hexdigest()[:16]
+
+        # Contatori aggiornati da più thread quando la pipeline è servita da QueryService
+        self._stats_lock = threading.Lock()
+        self.calls = 0
+        self.total_bytes = 0
+
+    def format_examples(self, few_shot_examples: List[Dict[str, str]]) -> str:
+        if not few_shot_examples:
+            return ""
+        examples_text = self.EXAMPLES_HEADER
+        for ex in few_shot_examples:
+            examples_text += f"\nDomanda Utente: {ex['question']}\nQuery Attesa:\n{ex['query']}\n"
+        return examples_text
+
+    def build(self, few_shot_examples: List[Dict[str, str]], user_question: str) -> Tuple[str, str]:
+        # La parte variabile (esempi + domanda) va sempre in coda al prompt
+        examples_text = self.format_examples(few_shot_examples)
+        user_content = f"{examples_text}\n{self.QUESTION_HEADER}{user_question}" if examples_text else user_question
+
+        prompt_bytes = self.prefix_bytes + len(user_content.encode('utf-8'))
+        with self._stats_lock:
+            self.calls += 1
+            self.total_bytes += prompt_bytes
+        return self.static_prefix, user_content
+
+    def stats(self) -> Dict:
+        with self._stats_lock:
+            calls, total_bytes = self.calls, self.total_bytes
+        reused_bytes = self.prefix_bytes * max(calls - 1, 0)
+        return {
+            'prefix_hash': self.prefix_hash,
+            'prefix_bytes': self.prefix_bytes,
+            'calls': calls,
+            'reused_prefix_bytes': reused_bytes,
+            'prefix_reuse_ratio': round(reused_bytes / total_bytes, 3) if total_bytes else 0.0
+        }
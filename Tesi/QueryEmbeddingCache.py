@@ -0,0 +1,77 @@
+import threading
+import numpy as np
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from EmbeddingStore import EmbeddingStore
+
+class QueryEmbeddingCache:
+    # LRU in memoria per gli embedding delle domande utente, con uno store persistente alle spalle
+    def __init__(self, store_dir: str, model_name: str, max_entries: int = 1024, flush_every: int = 64):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.flush_every = flush_every
+        self.store = EmbeddingStore(store_dir, model_name)
+        self._lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        # Embedding nuovi non ancora scritti: vanno nello store a blocchi, non uno alla volta
+        self._pending: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.store_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        # Solo gli spazi: le maiuscole restano, è questo il testo di cui si calcola l'embedding
+        return ' '.join(text.strip().split())
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        norm = self.normalize(text)
+        with self._lock:
+            vector = self._lru.get(norm)
+            if vector is None:
+                vector = self._pending.get(norm)
+            if vector is not None:
+                self._remember(norm, vector)
+                self.memory_hits += 1
+                return vector
+
+            vectors, missing = self.store.lookup([norm])
+            if missing:
+                self.misses += 1
+                return None
+            self.store_hits += 1
+            self._remember(norm, vectors[0])
+            return vectors[0]
+
+    def put(self, text: str, vector: np.ndarray):
+        norm = self.normalize(text)
+        vector = np.asarray(vector, dtype=np.float32)
+        with self._lock:
+            self._remember(norm, vector)
+            self._pending[norm] = vector
+            if len(self._pending) < self.flush_every:
+                return
+        self.flush()
+
+    def flush(self):
+        # Un solo segmento per tutti gli embedding in attesa
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            texts: List[str] = list(pending)
+            self.store.append_segment(texts, np.stack([pending[t] for t in texts]))
+
+    def _remember(self, norm: str, vector: np.ndarray):
+        self._lru[norm] = vector
+        self._lru.move_to_end(norm)
+        while len(self._lru) > self.max_entries:
+            self._lru.popitem(last=False)
+
+    def stats(self) -> Dict:
+        total = self.memory_hits + self.store_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'store_hits': self.store_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.memory_hits + self.store_hits) / total, 3) if total else 0.0
+        }
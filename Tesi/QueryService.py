@@ -0,0 +1,205 @@
+import os
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from typing import Dict, List, Optional
+
+from pipeline import AgriQueryPipeline, CONFIG_FILE, DB_CONFIG, MODELLI
+from queryExecutor import QueryExecutor
+
+class LatencyTracker:
+    # Ultime latenze per endpoint, per calcolare percentili senza crescere all'infinito
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self._samples: Dict[str, deque] = {}
+        self._counts: Dict[str, int] = {}
+        self.window = window
+
+    def record(self, endpoint: str, seconds: float):
+        with self._lock:
+            self._samples.setdefault(endpoint, deque(maxlen=self.window)).append(seconds)
+            self._counts[endpoint] = self._counts.get(endpoint, 0) + 1
+
+    def summary(self) -> Dict:
+        with self._lock:
+            result = {}
+            for endpoint, samples in self._samples.items():
+                ordered = sorted(samples)
+                result[endpoint] = {
+                    'count': self._counts[endpoint],
+                    'p50_ms': round(ordered[len(ordered) // 2] * 1000, 1),
+                    'p95_ms': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 1),
+                    'max_ms': round(ordered[-1] * 1000, 1)
+                }
+            return result
+
+class QueryService:
+    # Servizio HTTP/JSON locale: una AgriQueryPipeline "calda" per modello. Ogni richiesta è servita
+    # sul thread della sua connessione, con al massimo `workers` richieste in elaborazione e coda limitata
+    def __init__(self, config_path: str, models: List[str], workers: int = 4, max_queue: int = 64):
+        self.pipelines: Dict[str, AgriQueryPipeline] = {}
+        tokens = {model: token_env for _, model, token_env in MODELLI.values()}
+        for model in models:
+            token = os.getenv(tokens.get(model, ''))
+            if not token:
+                print(f"Token non trovato per {model}, modello non caricato")
+                continue
+            print(f"Caricamento pipeline per {model}")
+            pipeline = AgriQueryPipeline(config_path, selected_model=model, token=token)
+            # Selettore e prompt costruiti subito: le richieste non pagano lavoro di avvio
+            pipeline.get_selector()
+            pipeline.get_prompt()
+            self.pipelines[model] = pipeline
+        if not self.pipelines:
+            raise ValueError("Nessun modello caricato: controlla i token nel file .env")
+
+        self.default_model = next(iter(self.pipelines))
+        self.workers = workers
+        self.running = threading.BoundedSemaphore(workers)
+        # Posti in coda: oltre il limite le richieste vengono rifiutate invece di accumularsi
+        self.slots = threading.BoundedSemaphore(workers + max_queue)
+        self.pending = 0
+        self._pending_lock = threading.Lock()
+        self.latency = LatencyTracker()
+        self._executor_lock = threading.Lock()
+        self._query_executor: Optional[QueryExecutor] = None
+
+    def _executor(self) -> QueryExecutor:
+        # Un pool di connessioni condiviso (una per worker), aperto alla prima richiesta e poi riusato
+        with self._executor_lock:
+            if self._query_executor is None:
+                config = next(iter(self.pipelines.values())).config
+                # Il servizio restituisce le righe: niente streaming
+                executor = QueryExecutor.from_config(DB_CONFIG, config, workers=1, stream=False,
+                                                     result_cache_dir=None)
+                executor.db.connect_pool(self.workers)
+                self._query_executor = executor
+            return self._query_executor
+
+    def _pipeline(self, request: Dict) -> AgriQueryPipeline:
+        model = request.get('model', self.default_model)
+        if model not in self.pipelines:
+            raise KeyError(f"Modello non caricato: {model}")
+        return self.pipelines[model]
+
+    def generate(self, request: Dict) -> Dict:
+        return self._pipeline(request).generate(request['question'], k=request.get('k', 3))
+
+    def generate_execute(self, request: Dict) -> Dict:
+        result = self.generate(request)
+        executed = self._executor().execute_query(result['query'], request.get('id', 'request'))
+        result['rows'] = executed['results']
+        result['outcome'] = executed['outcome']
+        if 'error' in executed:
+            result['error'] = executed['error']
+        return result
+
+    def submit(self, endpoint: str, handler, request: Dict) -> Dict:
+        if not self.slots.acquire(blocking=False):
+            raise OverflowError("Coda piena, riprova più tardi")
+        with self._pending_lock:
+            self.pending += 1
+        start = time.perf_counter()
+        try:
+            # Il thread della connessione attende un posto da worker e poi esegue la richiesta direttamente
+            with self.running:
+                return handler(request)
+        finally:
+            self.latency.record(endpoint, time.perf_counter() - start)
+            with self._pending_lock:
+                self.pending -= 1
+            self.slots.release()
+
+    def health(self) -> Dict:
+        return {
+            'status': 'ok',
+            'models': list(self.pipelines),
+            'workers': self.workers,
+            'pending': self.pending
+        }
+
+    def make_handler(self):
+        # http.server caricato solo all'avvio del servizio, non per --help
+        from http.server import BaseHTTPRequestHandler
+        service = self
+        routes = {
+            '/generate': service.generate,
+            '/generate_execute': service.generate_execute
+        }
+
+        class Handler(BaseHTTPRequestHandler):
+            def _send(self, status: int, payload: Dict):
+                body = json.dumps(payload, ensure_ascii=False, default=str).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/health':
+                    self._send(200, service.health())
+                elif self.path == '/latency':
+                    self._send(200, service.latency.summary())
+                else:
+                    self._send(404, {'error': 'endpoint non trovato'})
+
+            def do_POST(self):
+                handler = routes.get(self.path)
+                if handler is None:
+                    self._send(404, {'error': 'endpoint non trovato'})
+                    return
+                try:
+                    length = int(self.headers.get('Content-Length', 0))
+                    request = json.loads(self.rfile.read(length) or b'{}')
+                    if not request.get('question'):
+                        raise ValueError("Campo 'question' mancante")
+                    self._send(200, service.submit(self.path, handler, request))
+                except (ValueError, KeyError) as e:
+                    self._send(400, {'error': str(e)})
+                except OverflowError as e:
+                    self._send(503, {'error': str(e)})
+                except Exception as e:
+                    self._send(500, {'error': str(e)})
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def serve(self, host: str, port: int):
+        from http.server import ThreadingHTTPServer
+        server = ThreadingHTTPServer((host, port), self.make_handler())
+        print(f"Servizio in ascolto su http://{host}:{port} (modelli: {', '.join(self.pipelines)})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\nArresto del servizio")
+        finally:
+            server.server_close()
+            if self._query_executor is not None:
+                self._query_executor.db.close_pool()
+            # Embedding delle domande ancora in memoria
+            for pipeline in self.pipelines.values():
+                pipeline.get_selector().query_cache.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Servizio HTTP/JSON per la pipeline NL -> Cypher')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help='Worker che elaborano le richieste')
+    parser.add_argument('--max-queue', type=int, default=64, help='Richieste in attesa oltre i worker')
+    parser.add_argument('--config', default=CONFIG_FILE)
+    parser.add_argument('--models', nargs='+', default=[model for _, model, _ in MODELLI.values()],
+                        help='Modelli da tenere caricati (serve il relativo token nel .env)')
+    args = parser.parse_args()
+
+    service = QueryService(args.config, args.models, workers=args.workers, max_queue=args.max_queue)
+    service.serve(args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
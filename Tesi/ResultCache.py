@@ -0,0 +1,99 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+from typing import Dict, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from CompareGraph import GraphElements
+
+class ResultCache:
+    # Cache persistente dei risultati già estratti (insiemi di nodi e archi) per query eseguite.
+    # La chiave è testo normalizzato della query + impronta dello stato del database:
+    # se i dati cambiano l'impronta cambia e le voci vecchie non vengono più usate.
+    # Le voci stanno in <cache_dir>/<database>/<snapshot>/: più database o checkout possono condividere la cache
+    def __init__(self, cache_dir: str, keep_snapshots: int = 4):
+        self.cache_dir = cache_dir
+        self.keep_snapshots = keep_snapshots
+        self.database: Optional[str] = None
+        self.snapshot: Optional[str] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        # Solo spazi e ';' finale: i letterali della query restano case-sensitive
+        return ' '.join(query.split()).rstrip(';').strip()
+
+    def set_snapshot(self, snapshot: Dict, database: str):
+        # database identifica il server e il DB (host:porta/nome), snapshot lo stato dei suoi dati
+        self.database = hashlib.sha256(database.encode('utf-8')).hexdigest()[:16]
+        self.snapshot = hashlib.sha256(
+            json.dumps(snapshot, sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:16]
+        current = os.path.join(self.cache_dir, self.database, self.snapshot)
+        os.makedirs(current, exist_ok=True)
+        # La data di modifica della cartella segna l'ultimo uso dello snapshot
+        os.utime(current)
+        self._prune()
+
+    def _prune(self):
+        # LRU per database: si tengono gli ultimi keep_snapshots snapshot usati, gli altri database non si toccano
+        root = os.path.join(self.cache_dir, self.database)
+        snapshots = [os.path.join(root, name) for name in os.listdir(root)
+                     if os.path.isdir(os.path.join(root, name))]
+        snapshots.sort(key=os.path.getmtime, reverse=True)
+        for path in snapshots[self.keep_snapshots:]:
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"Cache risultati: eliminate le voci dello snapshot {os.path.basename(path)}")
+
+    def _path(self, query: str) -> str:
+        key = hashlib.sha256(self.normalize(query).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, self.database, self.snapshot, key + ".json")
+
+    def get(self, query: str) -> Optional[Dict]:
+        if self.snapshot is None:
+            return None
+        try:
+            with open(self._path(query), 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        from CompareGraph import GraphElements
+        entry['elements'] = GraphElements.from_tuples(entry.pop('nodes'), entry.pop('edges'))
+        return entry
+
+    def put(self, query: str, elements: 'GraphElements', rows: int):
+        if self.snapshot is None:
+            return
+        path = self._path(query)
+        # Su disco tuple di stringhe: gli id interi valgono solo per la tabella di simboli di questa estrazione
+        entry = {
+            'query': self.normalize(query),
+            'rows': rows,
+            'nodes': sorted(elements.node_tuples()),
+            'edges': sorted(elements.edge_tuples()),
+            'created': datetime.now().isoformat(timespec='seconds')
+        }
+        # Scrittura atomica: più worker possono salvare in parallelo
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    def stats(self) -> Dict:
+        total = self.hits + self.misses
+        return {
+            'database': self.database,
+            'snapshot': self.snapshot,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
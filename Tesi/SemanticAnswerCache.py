@@ -0,0 +1,114 @@
+import os
+import json
+import threading
+import numpy as np
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+class SemanticAnswerCache:
+    # Cache domanda -> query validata. Una domanda nuova abbastanza simile a una già validata
+    # (stessa versione dello schema, stesso modello di embedding, stesso LLM e stesso prefisso
+    # delle istruzioni) riceve subito la query salvata
+    ENTRIES_FILE = "entries.json"
+    MATRIX_FILE = "embeddings.npy"
+
+    def __init__(self, cache_dir: str, embedding_model: str, llm_model: str, prefix_hash: str,
+                 threshold: float = 0.95):
+        self.cache_dir = cache_dir
+        self.embedding_model = embedding_model
+        self.llm_model = llm_model
+        self.prefix_hash = prefix_hash
+        self.threshold = threshold
+        # Contatori di hit modificati ma non ancora scritti (vedi flush)
+        self._dirty = False
+        self._lock = threading.Lock()
+        self.entries: List[Dict] = []
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self._load()
+
+    def _load(self):
+        entries_path = os.path.join(self.cache_dir, self.ENTRIES_FILE)
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        if not (os.path.exists(entries_path) and os.path.exists(matrix_path)):
+            return
+        try:
+            with open(entries_path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+            vectors = np.load(matrix_path)
+        except (OSError, ValueError) as e:
+            print(f"Cache delle risposte illeggibile ({e}), si riparte da vuota")
+            return
+        if len(entries) != len(vectors):
+            print("Cache delle risposte incoerente, si riparte da vuota")
+            return
+        self.entries = entries
+        self.vectors = vectors.astype(np.float32)
+
+    def _save(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries_path = os.path.join(self.cache_dir, self.ENTRIES_FILE)
+        matrix_path = os.path.join(self.cache_dir, self.MATRIX_FILE)
+        with open(matrix_path + ".tmp", 'wb') as f:
+            np.save(f, self.vectors)
+        with open(entries_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+        os.replace(matrix_path + ".tmp", matrix_path)
+        os.replace(entries_path + ".tmp", entries_path)
+
+    @staticmethod
+    def _unit(vector: np.ndarray) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def lookup(self, question_vec: np.ndarray, schema_version: str) -> Optional[Tuple[Dict, float]]:
+        question_vec = self._unit(question_vec)
+        with self._lock:
+            if not self.entries or not question_vec.any() or self.vectors.shape[1] != len(question_vec):
+                return None
+
+            compatible = np.array([e['schema_version'] == schema_version
+                                   and e['embedding_model'] == self.embedding_model
+                                   and e['llm_model'] == self.llm_model
+                                   and e['prefix_hash'] == self.prefix_hash
+                                   for e in self.entries])
+            similarities = np.where(compatible, self.vectors @ question_vec, -np.inf)
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.threshold:
+                return None
+
+            # Si registra quale voce ha servito la risposta; su disco al prossimo salvataggio o flush
+            entry = self.entries[best]
+            entry['hits'] += 1
+            entry['last_hit'] = datetime.now().isoformat(timespec='seconds')
+            self._dirty = True
+            return entry, float(similarities[best])
+
+    def flush(self):
+        with self._lock:
+            if self._dirty:
+                self._save()
+                self._dirty = False
+
+    def store(self, question: str, query: str, question_vec: np.ndarray, schema_version: str) -> Dict:
+        question_vec = self._unit(question_vec)
+        with self._lock:
+            if self.vectors.shape[1] not in (0, len(question_vec)):
+                raise ValueError("Dimensione embedding diversa da quella della cache delle risposte")
+            entry = {
+                'entry_id': len(self.entries) + 1,
+                'question': question,
+                'query': query,
+                'schema_version': schema_version,
+                'embedding_model': self.embedding_model,
+                'llm_model': self.llm_model,
+                'prefix_hash': self.prefix_hash,
+                'hits': 0,
+                'created': datetime.now().isoformat(timespec='seconds')
+            }
+            self.entries.append(entry)
+            vectors = self.vectors if self.vectors.shape[1] else np.zeros((0, len(question_vec)), dtype=np.float32)
+            self.vectors = np.vstack([vectors, question_vec[np.newaxis, :]])
+            self._save()
+            self._dirty = False
+            return entry
@@ -0,0 +1,67 @@
+import hashlib
+import json
+import threading
+import time
+from typing import Any, Callable, Dict
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Exception = None
+        self.finished_at = 0.0
+
+class SingleFlight:
+    # Coalescing delle chiamate identiche in volo: una sola chiamata upstream,
+    # il risultato viene condiviso con tutti i chiamanti concorrenti e tenuto per `window` secondi
+    def __init__(self, window: float = 5.0):
+        self.window = window
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self.upstream_calls = 0
+        self.shared_calls = 0
+
+    @staticmethod
+    def fingerprint(*parts: Any) -> str:
+        payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _evict_expired(self, now: float):
+        expired = [key for key, call in self._calls.items()
+                   if call.done.is_set() and now - call.finished_at > self.window]
+        for key in expired:
+            del self._calls[key]
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        with self._lock:
+            self._evict_expired(time.monotonic())
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.upstream_calls += 1
+            else:
+                self.shared_calls += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            # Gli errori non vengono mantenuti nella finestra: la prossima richiesta riprova
+            with self._lock:
+                self._calls.pop(key, None)
+            raise
+        finally:
+            call.finished_at = time.monotonic()
+            call.done.set()
+        return call.result
+
+    def stats(self) -> Dict[str, int]:
+        return {'upstream_calls': self.upstream_calls, 'shared_calls': self.shared_calls}
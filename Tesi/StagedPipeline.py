@@ -0,0 +1,80 @@
+import time
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+_DONE = object()
+
+class StagedPipeline:
+    # Pipeline produttore/consumatore: ogni stadio ha i propri worker e una coda limitata in ingresso,
+    # così un elemento passa allo stadio successivo appena è pronto e gli stadi lavorano in parallelo.
+    # Uno stadio che ritorna None scarta l'elemento
+    def __init__(self, stages: List[Tuple[str, Callable[[Any], Any], int]], queue_size: int = 4):
+        self.stages = stages
+        self.queue_size = queue_size
+        self.busy_time: Dict[str, float] = {name: 0.0 for name, _, _ in stages}
+
+    def run(self, items: Iterable[Any]) -> Dict[str, float]:
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        stop = threading.Event()
+        errors: List[Exception] = []
+        lock = threading.Lock()
+        remaining = [workers for _, _, workers in self.stages]
+        threads = []
+
+        def worker(index: int):
+            name, fn, _ = self.stages[index]
+            in_queue = queues[index]
+            out_queue = queues[index + 1] if index + 1 < len(queues) else None
+            while True:
+                item = in_queue.get()
+                if item is _DONE:
+                    # Il segnale di fine viene ripassato agli altri worker dello stesso stadio
+                    in_queue.put(_DONE)
+                    break
+                if stop.is_set():
+                    continue
+                start = time.perf_counter()
+                try:
+                    result = fn(item)
+                except Exception as e:
+                    with lock:
+                        errors.append(e)
+                    stop.set()
+                    continue
+                finally:
+                    with lock:
+                        self.busy_time[name] += time.perf_counter() - start
+                if result is not None and out_queue is not None:
+                    out_queue.put(result)
+
+            # L'ultimo worker dello stadio chiude lo stadio successivo
+            with lock:
+                remaining[index] -= 1
+                last = remaining[index] == 0
+            if last and out_queue is not None:
+                out_queue.put(_DONE)
+
+        for index, (_, _, workers) in enumerate(self.stages):
+            for _ in range(workers):
+                thread = threading.Thread(target=worker, args=(index,), daemon=True)
+                thread.start()
+                threads.append(thread)
+
+        start = time.perf_counter()
+        for item in items:
+            if stop.is_set():
+                break
+            queues[0].put(item)
+        queues[0].put(_DONE)
+
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        if errors:
+            raise errors[0]
+
+        stats = dict(self.busy_time)
+        stats['wall_time'] = elapsed
+        return stats
@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+from collections import deque
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+class Tracer:
+    # Span per stadio e per query (durata + attributi), esportabili nel formato Chrome trace
+    # apribile con Perfetto o chrome://tracing. Da disattivato uno span costa solo un controllo
+    INHERITED = ('query_id', 'model')
+
+    def __init__(self, max_spans: int = 200000):
+        self.enabled = False
+        self._lock = threading.Lock()
+        # Span padre corrente: ContextVar funziona sia tra thread sia tra task asyncio
+        self._parent: ContextVar[Optional[Dict]] = ContextVar('tracer_parent', default=None)
+        # Buffer circolare: se il tracer resta acceso a lungo si tengono solo gli span più recenti
+        self.max_spans = max_spans
+        self.spans: deque = deque(maxlen=max_spans)
+        self.dropped = 0
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self.spans = deque(maxlen=self.max_spans)
+            self.dropped = 0
+            self._origin = time.perf_counter()
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        if not self.enabled:
+            yield {}
+            return
+        # query_id e modello passano agli span annidati dello stesso thread o task
+        parent = self._parent.get()
+        if parent:
+            attrs = {**{k: parent[k] for k in self.INHERITED if k in parent}, **attrs}
+        token = self._parent.set(attrs)
+        start = time.perf_counter()
+        try:
+            yield attrs
+        finally:
+            end = time.perf_counter()
+            self._parent.reset(token)
+            with self._lock:
+                if len(self.spans) == self.max_spans:
+                    self.dropped += 1
+                self.spans.append({
+                    'name': name,
+                    'start': start - self._origin,
+                    'duration': end - start,
+                    'thread': threading.get_ident(),
+                    'attrs': attrs
+                })
+
+    def export_chrome(self, path: str):
+        # Eventi "complete" (ph = X) con tempi in microsecondi
+        with self._lock:
+            spans = list(self.spans)
+        threads = {tid: i for i, tid in enumerate(dict.fromkeys(s['thread'] for s in spans))}
+        events = [{
+            'name': s['name'],
+            'cat': 'pipeline',
+            'ph': 'X',
+            'ts': round(s['start'] * 1e6, 1),
+            'dur': round(s['duration'] * 1e6, 1),
+            'pid': os.getpid(),
+            'tid': threads[s['thread']],
+            'args': s['attrs']
+        } for s in spans]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+        print(f"Trace salvato in: {path} ({len(events)} span"
+              + (f", {self.dropped} più vecchi scartati)" if self.dropped else ")"))
+
+    def summary(self) -> Dict[str, Dict]:
+        with self._lock:
+            spans = list(self.spans)
+        durations: Dict[str, List[float]] = {}
+        for s in spans:
+            durations.setdefault(s['name'], []).append(s['duration'])
+        result = {}
+        for name, values in durations.items():
+            values.sort()
+            result[name] = {
+                'count': len(values),
+                'total_s': sum(values),
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p95_ms': values[min(len(values) - 1, int(len(values) * 0.95))] * 1000,
+                'max_ms': values[-1] * 1000
+            }
+        return result
+
+    def print_summary(self, title: Optional[str] = None):
+        summary = self.summary()
+        if not summary:
+            return
+        print(f"\n{title or 'Tempi per stadio'}")
+        print(f"{'stadio':<22}{'n':>6}{'totale s':>11}{'media ms':>11}{'p95 ms':>10}{'max ms':>10}")
+        for name, s in sorted(summary.items(), key=lambda x: x[1]['total_s'], reverse=True):
+            print(f"{name:<22}{s['count']:>6}{s['total_s']:>11.3f}{s['mean_ms']:>11.1f}"
+                  f"{s['p95_ms']:>10.1f}{s['max_ms']:>10.1f}")
+
+
+# Tracer condiviso da tutti i moduli della pipeline
+tracer = Tracer()
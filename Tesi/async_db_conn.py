@@ -0,0 +1,106 @@
+# Dipendenza opzionale non inclusa tra quelle di db_conn: psycopg 3 (pip install 'psycopg[binary]'),
+# necessaria solo per AsyncQueryExecutor. Il resto della pipeline usa psycopg2
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+
+from db_conn import db_conn, QueryTimeout
+
+class async_db_conn:
+    # Variante asyncio di db_conn (psycopg 3): pool di connessioni AGE già inizializzate,
+    # stessa semantica di execute_raw/parse_agtype ma senza un thread per query
+    def __init__(self, db_config: Dict[str, str], pool_size: int = 10):
+        self.db_config = db_config
+        self.pool_size = pool_size
+        self.connections: List[Any] = []
+        self._free: Optional[asyncio.Queue] = None
+        self._psycopg = None
+
+    def _load_driver(self):
+        # psycopg 3 è opzionale: serve solo per la modalità asincrona
+        if self._psycopg is None:
+            try:
+                import psycopg
+            except ImportError as e:
+                raise ImportError("Async mode requires psycopg 3: pip install 'psycopg[binary]'") from e
+            self._psycopg = psycopg
+        return self._psycopg
+
+    async def _open(self):
+        psycopg = self._load_driver()
+        connection = await psycopg.AsyncConnection.connect(
+            host=self.db_config['host'],
+            port=self.db_config['port'],
+            dbname=self.db_config['database'],
+            user=self.db_config['user'],
+            password=self.db_config['password'],
+            autocommit=True
+        )
+        # Load AGE extension, una volta per connessione
+        await connection.execute("LOAD 'age';")
+        await connection.execute("SET search_path = ag_catalog, '$user', public;")
+        return connection
+
+    async def connect(self):
+        try:
+            self.connections = list(await asyncio.gather(*(self._open() for _ in range(self.pool_size))))
+        except Exception as e:
+            print(f"Database connection error: {e}")
+            await self.disconnect()
+            raise
+        self._free = asyncio.Queue()
+        for connection in self.connections:
+            self._free.put_nowait(connection)
+        print(f"Async database pool established ({self.pool_size} connections)")
+
+    async def disconnect(self):
+        for connection in self.connections:
+            await connection.close()
+        self.connections = []
+        self._free = None
+        print("Connection closed")
+
+    async def _acquire(self):
+        if self._free is None:
+            raise RuntimeError("Connection pool not available")
+        connection = await self._free.get()
+        if connection.closed:
+            # Connessione caduta: ne viene aperta (e inizializzata) una nuova al suo posto
+            try:
+                replacement = await self._open()
+            except Exception:
+                # Il posto nel pool non va perso: la connessione chiusa torna in coda e il prossimo _acquire riprova
+                self._free.put_nowait(connection)
+                raise
+            self.connections.remove(connection)
+            self.connections.append(replacement)
+            connection = replacement
+        return connection
+
+    async def execute_raw(self, query: str, timeout_ms: Optional[int] = None) -> Tuple[List[tuple], List[str]]:
+        psycopg = self._load_driver()
+        connection = await self._acquire()
+        try:
+            async with connection.cursor() as cursor:
+                if timeout_ms:
+                    # SET non accetta parametri lato server (psycopg 3 li lega sul server): set_config sì
+                    await cursor.execute("SELECT set_config('statement_timeout', %s, false);", (str(int(timeout_ms)),))
+                try:
+                    await cursor.execute(query.strip())
+                    if cursor.description is None:
+                        return [], []
+                    rows = await cursor.fetchall()
+                    column_names = [desc.name for desc in cursor.description]
+                    return rows, column_names
+                except psycopg.errors.QueryCanceled as e:
+                    raise QueryTimeout(f"Query cancelled after {timeout_ms} ms: {str(e).strip()}") from e
+                finally:
+                    if timeout_ms and not connection.closed:
+                        try:
+                            await cursor.execute("RESET statement_timeout;")
+                        except psycopg.Error:
+                            pass
+        finally:
+            self._free.put_nowait(connection)
+
+    # Stesso parsing dei valori agtype della versione sincrona
+    parse_agtype = db_conn.parse_agtype
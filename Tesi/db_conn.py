@@ -1,71 +1,267 @@
 import json
+import uuid
+import threading
 import psycopg2
 import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.errors
+import psycopg2.extras
+from contextlib import contextmanager
+from AgtypeDecoder import AgtypeDecoder, JSON_LOADS
 from psycopg2.extensions import cursor as PgCursor, connection as PgConnection
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Dict, Iterator, List, Optional, Set, Tuple, Any
+
+class QueryTimeout(Exception):
+    # La query ha superato lo statement_timeout ed è stata annullata dal server
+    pass
 
 class db_conn:
     def __init__(self, db_config: Dict[str, str]):
         self.db_config = db_config
         self.connection: Optional[PgConnection] = None
         self.cursor: Optional[PgCursor] = None
-    
+        self.pool: Optional[psycopg2.pool.ThreadedConnectionPool] = None
+        # Connessioni del pool su cui AGE è già stato caricato
+        self._initialized: Set[int] = set()
+        self._pool_lock = threading.Lock()
+
+    def _connect_params(self) -> Dict[str, str]:
+        return {
+            'host': self.db_config['host'],
+            'port': self.db_config['port'],
+            'database': self.db_config['database'],
+            'user': self.db_config['user'],
+            'password': self.db_config['password']
+        }
+
+    @staticmethod
+    def _init_age(connection: PgConnection):
+        connection.set_isolation_level(
+            psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
+        )
+        # Colonne json decodificate una sola volta dal driver, con il loader più veloce disponibile
+        psycopg2.extras.register_default_json(connection, loads=JSON_LOADS)
+        with connection.cursor() as cursor:
+            # Load AGE extension
+            cursor.execute("LOAD 'age';")
+            cursor.execute("SET search_path = ag_catalog, '$user', public;")
+
     def connect(self):
         try:
-            self.connection = psycopg2.connect(
-                host=self.db_config['host'],
-                port=self.db_config['port'],
-                database=self.db_config['database'],
-                user=self.db_config['user'],
-                password=self.db_config['password']
-            )
-            
-            self.connection.set_isolation_level(
-                psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT
-            )
-            
+            self.connection = psycopg2.connect(**self._connect_params())
+            self._init_age(self.connection)
             self.cursor = self.connection.cursor()
-            
-            # Load AGE extension
-            self.cursor.execute("LOAD 'age';")
-            self.cursor.execute("SET search_path = ag_catalog, '$user', public;")
-            
+
             print("Database connection established")
-            
+
         except Exception as e:
             print(f"Database connection error: {e}")
             raise
 
+    def connect_pool(self, size: int):
+        # Pool di connessioni AGE già pronte: LOAD 'age' e search_path una sola volta per connessione
+        try:
+            self.pool = psycopg2.pool.ThreadedConnectionPool(size, size, **self._connect_params())
+            connections = [self.pool.getconn() for _ in range(size)]
+            for connection in connections:
+                self._checkout_init(connection)
+            for connection in connections:
+                self.pool.putconn(connection)
+            print(f"Database pool established ({size} connections)")
+        except Exception as e:
+            print(f"Database connection error: {e}")
+            self.close_pool()
+            raise
+
+    def _checkout_init(self, connection: PgConnection):
+        # Una connessione ricreata dal pool (dopo un errore) viene inizializzata al primo utilizzo
+        with self._pool_lock:
+            if id(connection) in self._initialized:
+                return
+        self._init_age(connection)
+        with self._pool_lock:
+            self._initialized.add(id(connection))
+
+    @contextmanager
+    def pooled_connection(self):
+        if self.pool is None:
+            raise RuntimeError("Connection pool not available")
+        connection = self.pool.getconn()
+        broken = False
+        try:
+            self._checkout_init(connection)
+            yield connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            broken = True
+            raise
+        finally:
+            broken = broken or connection.closed != 0
+            if broken:
+                with self._pool_lock:
+                    self._initialized.discard(id(connection))
+            self.pool.putconn(connection, close=broken)
+
+    @contextmanager
+    def pooled_cursor(self):
+        with self.pooled_connection() as connection:
+            with connection.cursor() as cursor:
+                yield cursor
+
+    def close_pool(self):
+        if self.pool is not None:
+            self.pool.closeall()
+            self.pool = None
+        with self._pool_lock:
+            self._initialized.clear()
+
     def disconnect(self):
         if self.cursor:
             self.cursor.close()
+            self.cursor = None
         if self.connection:
             self.connection.close()
+            self.connection = None
+        self.close_pool()
         print("Connection closed")
-    
-    def execute_raw(self, query: str) -> Tuple[List[tuple], List[str]]:
+
+    @contextmanager
+    def _any_cursor(self):
+        # Con il pool aperto ogni chiamata prende una connessione libera: sicuro da più thread
+        if self.pool is not None:
+            with self.pooled_cursor() as cursor:
+                yield cursor
+            return
+
         if self.cursor is None:
             raise RuntimeError(
                 "Cursor not available"
             )
-        
-        query_clean = query.strip()
-        
-        self.cursor.execute(query_clean)
-        
-        if self.cursor.description is None:
+        yield self.cursor
+
+    @contextmanager
+    def _any_connection(self):
+        if self.pool is not None:
+            with self.pooled_connection() as connection:
+                yield connection
+            return
+
+        if self.connection is None:
+            raise RuntimeError(
+                "Connection not available"
+            )
+        yield self.connection
+
+    @staticmethod
+    @contextmanager
+    def _statement_timeout(cursor: PgCursor, timeout_ms: Optional[int]):
+        # Timeout valido solo per questa query: la sessione torna al default subito dopo
+        if not timeout_ms:
+            yield
+            return
+        cursor.execute("SET statement_timeout = %s;", (int(timeout_ms),))
+        try:
+            yield
+        except psycopg2.errors.QueryCanceled as e:
+            raise QueryTimeout(f"Query cancelled after {timeout_ms} ms: {str(e).strip()}") from e
+        finally:
+            # Su una connessione caduta il RESET fallirebbe e coprirebbe l'errore originale
+            if not cursor.connection.closed:
+                try:
+                    cursor.execute("RESET statement_timeout;")
+                except psycopg2.Error:
+                    pass
+
+    @staticmethod
+    def _fetch(cursor: PgCursor, query: str) -> Tuple[List[tuple], List[str]]:
+        cursor.execute(query.strip())
+        if cursor.description is None:
             return [], []
-        rows = self.cursor.fetchall()
-        column_names = [desc[0] for desc in self.cursor.description]
+        rows = cursor.fetchall()
+        column_names = [desc[0] for desc in cursor.description]
         return rows, column_names
-            
+
+    def execute_raw(self, query: str, timeout_ms: Optional[int] = None) -> Tuple[List[tuple], List[str]]:
+        with self._any_cursor() as cursor:
+            with self._statement_timeout(cursor, timeout_ms):
+                return self._fetch(cursor, query)
+
+    def stream_raw(self, query: str, itersize: int = 2000, timeout_ms: Optional[int] = None) -> Iterator[tuple]:
+        # Cursore lato server: le righe arrivano a blocchi di itersize invece che tutte con fetchall.
+        # Un cursore con nome richiede una transazione, aperta solo per la durata dello streaming
+        with self._any_connection() as connection:
+            connection.autocommit = False
+            try:
+                if timeout_ms:
+                    with connection.cursor() as control:
+                        # SET LOCAL: vale per ogni FETCH della transazione e decade con il rollback
+                        control.execute("SET LOCAL statement_timeout = %s;", (int(timeout_ms),))
+                with connection.cursor(name=f"stream_{uuid.uuid4().hex}") as cursor:
+                    cursor.itersize = itersize
+                    cursor.execute(query.strip())
+                    for row in cursor:
+                        yield row
+            except psycopg2.errors.QueryCanceled as e:
+                raise QueryTimeout(f"Query cancelled after {timeout_ms} ms: {str(e).strip()}") from e
+            finally:
+                if not connection.closed:
+                    connection.rollback()
+                    connection.autocommit = True
+
+    @staticmethod
+    def json_wrapped(query: str) -> str:
+        # Ogni riga diventa un oggetto JSON {colonna: valore}; le colonne agtype passano dal cast
+        # agtype -> json, quindi vertici, archi e path arrivano già strutturati
+        return f"SELECT to_json(q) FROM ({query.strip().rstrip(';')}) AS q"
+
+    def execute_json(self, query: str, timeout_ms: Optional[int] = None) -> List[Dict[str, Any]]:
+        rows, _ = self.execute_raw(self.json_wrapped(query), timeout_ms)
+        return [row[0] for row in rows]
+
+    def explain(self, query: str, timeout_ms: Optional[int] = None) -> Dict[str, float]:
+        # Stima del planner senza eseguire la query: costo totale e righe previste
+        with self._any_cursor() as cursor:
+            with self._statement_timeout(cursor, timeout_ms):
+                cursor.execute("EXPLAIN (FORMAT JSON) " + query.strip().rstrip(';'))
+                plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        root = plan[0]['Plan']
+        return {'cost': float(root['Total Cost']), 'rows': float(root['Plan Rows'])}
+
+    def snapshot_fingerprint(self, measurements_table: str = 'public.measurements',
+                             timestamp_column: str = 'timestamp') -> Dict[str, Any]:
+        # Impronta economica dello stato dei dati: righe stimate e contatori di modifica delle tabelle
+        # delle label AGE, più l'ultimo timestamp delle misure
+        snapshot: Dict[str, Any] = {}
+        with self._any_cursor() as cursor:
+            cursor.execute(
+                "SELECT l.name, c.reltuples, coalesce(s.n_tup_ins + s.n_tup_upd + s.n_tup_del, 0) "
+                "FROM ag_catalog.ag_label l "
+                "JOIN pg_class c ON c.oid = l.relation "
+                "LEFT JOIN pg_stat_user_tables s ON s.relid = l.relation "
+                "ORDER BY l.name;"
+            )
+            snapshot['labels'] = {name: [float(tuples), int(changes)] for name, tuples, changes in cursor.fetchall()}
+            try:
+                cursor.execute(f"SELECT max({timestamp_column}) FROM {measurements_table};")
+                snapshot['measurements'] = str(cursor.fetchone()[0])
+            except psycopg2.Error:
+                # Database senza tabella delle misure: resta solo l'impronta del grafo
+                snapshot['measurements'] = None
+        return snapshot
+
+    def explain_analyze(self, query: str, timeout_ms: Optional[int] = None) -> Dict[str, Any]:
+        # Esegue davvero la query: piano con tempi reali, righe effettive e statistiche dei buffer
+        with self._any_cursor() as cursor:
+            with self._statement_timeout(cursor, timeout_ms):
+                cursor.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query.strip().rstrip(';'))
+                plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]
+
     def parse_agtype(self, value: Any) -> Any:
         if value is None:
             return None
-        if isinstance(value, str):
-            clean = value.split('::')[0].strip()
-            try:
-                return json.loads(clean)
-            except (json.JSONDecodeError, TypeError):
-                return value
-        return value
\ No newline at end of file
+        # Anche i path (::path con vertici/archi annidati) vengono decodificati qui, una volta sola
+        return AgtypeDecoder.decode(value)
\ No newline at end of file
@@ -0,0 +1,93 @@
+import os
+import re
+import sys
+import time
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+# Profilo dei tempi di import degli entry point (python -X importtime <script> --help).
+# Serve a controllare che l'avvio della CLI non carichi moduli pesanti prima che servano
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ENTRY_POINTS = {
+    'pipeline': os.path.join('Tesi', 'pipeline.py'),
+    'queryExecutor': os.path.join('Tesi', 'queryExecutor.py'),
+    'QueryService': os.path.join('Tesi', 'QueryService.py'),
+    'AsyncQueryExecutor': os.path.join('Tesi', 'AsyncQueryExecutor.py'),
+    'CompareQueries': os.path.join('src', 'queries', 'CompareQueries.py'),
+}
+
+# Moduli che non dovrebbero comparire all'avvio
+HEAVY_MODULES = ['numpy', 'psycopg2', 'azure', 'sklearn']
+
+LINE_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$')
+
+def wall_time(args: List[str], repeat: int) -> float:
+    # Miglior tempo su più avvii, senza -X importtime che rallenta l'interprete
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, capture_output=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def import_times(args: List[str]) -> List[Tuple[str, int, int]]:
+    result = subprocess.run([sys.executable, '-X', 'importtime'] + args, cwd=ROOT, capture_output=True, text=True)
+    # Ogni riga: (modulo, cumulativo in us, livello di annidamento)
+    imports = []
+    for line in result.stderr.splitlines():
+        match = LINE_RE.match(line)
+        if match:
+            depth = (len(match.group(3)) - 1) // 2
+            imports.append((match.group(4), int(match.group(2)), depth))
+    return imports
+
+def report(name: str, wall: float, imports: List[Tuple[str, int, int]], startup: set, top: int) -> Dict:
+    # Gli import dell'interprete (site, encodings, ...) sono uguali per tutti e non vengono contati
+    imports = [item for item in imports if item[0] not in startup]
+    top_level = [(module, cumulative) for module, cumulative, depth in imports if depth == 0]
+    total_ms = sum(cumulative for _, cumulative in top_level) / 1000
+    loaded = {module for module, _, _ in imports}
+    heavy = [h for h in HEAVY_MODULES if h in loaded or any(m.startswith(h + '.') for m in loaded)]
+
+    print(f"\n{name}: --help in {wall * 1000:.0f} ms (import propri {total_ms:.1f} ms)")
+    for module, cumulative in sorted(top_level, key=lambda x: x[1], reverse=True)[:top]:
+        print(f"  {cumulative / 1000:8.1f} ms  {module}")
+    if heavy:
+        print(f"  ATTENZIONE: moduli pesanti caricati all'avvio: {', '.join(heavy)}")
+    return {'wall_ms': wall * 1000, 'imports_ms': total_ms, 'heavy': heavy}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Profilo dei tempi di import degli entry point')
+    parser.add_argument('entry_points', nargs='*', default=list(ENTRY_POINTS),
+                        help=f"Entry point da profilare (default: tutti tra {', '.join(ENTRY_POINTS)})")
+    parser.add_argument('--top', type=int, default=10, help='Import di primo livello più lenti da mostrare')
+    parser.add_argument('--budget-ms', type=float, default=100.0, help='Tempo massimo accettato per --help')
+    parser.add_argument('--repeat', type=int, default=5, help='Avvii per la misura del tempo totale')
+    args = parser.parse_args()
+
+    startup = {module for module, _, _ in import_times(['-c', 'pass'])}
+    baseline = wall_time(['-c', 'pass'], args.repeat)
+    print(f"Avvio interprete a vuoto: {baseline * 1000:.0f} ms")
+
+    over_budget = []
+    for name in args.entry_points:
+        if name not in ENTRY_POINTS:
+            print(f"Entry point sconosciuto: {name}")
+            continue
+        script = ENTRY_POINTS[name]
+        wall = wall_time([script, '--help'], args.repeat)
+        summary = report(name, wall, import_times([script, '--help']), startup, args.top)
+        if summary['wall_ms'] > args.budget_ms or summary['heavy']:
+            over_budget.append(name)
+
+    if over_budget:
+        print(f"\nFuori budget ({args.budget_ms:.0f} ms o moduli pesanti): {', '.join(over_budget)}")
+        sys.exit(1)
+    print(f"\nTutti gli entry point entro {args.budget_ms:.0f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,20 @@
 import os
 import yaml
 import re
-from typing import Dict, List
+import argparse
+from typing import Dict, List, Optional, TYPE_CHECKING
 from dotenv import load_dotenv
 
-from LLMClient import LLMClient
 from SchemaExtractor import SchemaExtractor
-from FewShotSelector import FewShotSelector
-from queryExecutor import QueryExecutor
+from PromptBuilder import PromptBuilder
+from JsonlCheckpoint import JsonlCheckpoint
+from StagedPipeline import StagedPipeline
+from Tracer import tracer
+
+# I moduli pesanti (numpy, client Azure, psycopg2) vengono importati solo quando servono,
+# così --help e il menu partono subito
+if TYPE_CHECKING:
+    from FewShotSelector import FewShotSelector
 
 # Insegna a yaml a usare la pipe "|" per le stringhe multilinea così da mantenere la leggibilità del codice
 def str_presenter(dumper, data):
@@ -24,18 +31,31 @@ class AgriQueryPipeline:
     def __init__(self, config_path: str, selected_model: str = None, token: str = None):
         with open(config_path, 'r', encoding='utf-8') as f:
             self.config = yaml.safe_load(f)
-        
         # Usa il modello scelto dinamicamente, o il default del config
         model_name = selected_model or self.config.get('model_name', 'gpt-4o')
         # Passiamo sia il nome del modello che il token dedicato al Client
+        from LLMClient import LLMClient
         self.client = LLMClient(model_name=model_name, token=token)
+        self.token = token
+        self._selector: Optional['FewShotSelector'] = None
+        self._prompt: Optional[PromptBuilder] = None
+
+    def get_prompt(self) -> PromptBuilder:
+        # Istruzioni e schema vengono caricati una sola volta, alla prima richiesta (dentro il test se
+        # tracciato), e riusati come prefisso statico del prompt
+        if self._prompt is None:
+            with tracer.span('schema_extraction'):
+                schema = SchemaExtractor.get_full_prompt_context(self.config['refined_graph_path'])
+            self._prompt = PromptBuilder(self.config['instructions_path'], schema)
+        return self._prompt
 
     def load_dataset(self) -> List[Dict]:
         #Uniamo i file per creare gli esempi per il few_shot
-        with open(self.config['ground_truth_path'], 'r', encoding='utf-8') as f:
-            gt_data = yaml.safe_load(f)['responses_results']
-        with open(self.config['template_query_path'], 'r', encoding='utf-8') as f:
-            tp_data = yaml.safe_load(f)['query_descriptions']
+        with tracer.span('yaml_load', file='few_shot'):
+            with open(self.config['ground_truth_path'], 'r', encoding='utf-8') as f:
+                gt_data = yaml.safe_load(f)['responses_results']
+            with open(self.config['template_query_path'], 'r', encoding='utf-8') as f:
+                tp_data = yaml.safe_load(f)['query_descriptions']
         
         queries = {str(item['id']): item['query'] for item in gt_data}
         dataset = []
@@ -49,17 +69,55 @@ class AgriQueryPipeline:
                 })
         return dataset
 
+    def _build_selector(self, dataset: List[Dict]) -> 'FewShotSelector':
+        # "exact" per banchi piccoli, "ivf" (indice approssimato) per banchi molto grandi
+        # Il backend di embedding (remoto o locale) viene scelto in pipeline_conf.yaml
+        from FewShotSelector import FewShotSelector
+        from EmbeddingBackend import create_embedding_backend
+        with tracer.span('selector_build', examples=len(dataset)):
+            backend = create_embedding_backend(self.config, self.token)
+            return FewShotSelector(ground_truth_examples=dataset, backend=backend,
+                                   index_type=self.config.get('few_shot_index', 'exact'))
+
+    def get_selector(self) -> 'FewShotSelector':
+        # Selettore "caldo": costruito una volta e riusato finché la pipeline resta in memoria
+        if self._selector is None:
+            self._selector = self._build_selector(self.load_dataset())
+        return self._selector
+
+    def generate(self, user_question: str, k: int = 3) -> Dict:
+        few_shot = self.get_selector().select_top_k(user_question, k=k)
+        generated = self.client.generate_query(
+            prompt=self.get_prompt(),
+            few_shot_examples=few_shot,
+            user_question=user_question
+        )
+        if generated == self.client.ERROR_MESSAGE:
+            raise RuntimeError(generated)
+        return {
+            "question": user_question,
+            "few_shot_ids": [ex.get('id') for ex in few_shot],
+            "query": self.extract_cypher(generated)
+        }
+
     def extract_cypher(self, text: str) -> str:
-        match = re.search(r'[`]{3}(?:cypher|sql)?\n(.*?)\n[`]{3}', text, re.DOTALL | re.IGNORECASE)
-        return match.group(1).strip() if match else text.strip()
+        with tracer.span('extract_cypher'):
+            match = re.search(r'[`]{3}(?:cypher|sql)?\n(.*?)\n[`]{3}', text, re.DOTALL | re.IGNORECASE)
+            return match.group(1).strip() if match else text.strip()
 
     def start(self):
         print("Lettura system_instructions")
-        dataset = self.load_dataset()
-        schema = SchemaExtractor.get_full_prompt_context(self.config['refined_graph_path'])
+        from SemanticAnswerCache import SemanticAnswerCache
         
-        # Il selettore viene creato
-        selector = FewShotSelector(ground_truth_examples=dataset,token=token)
+        # Selettore e prompt vengono creati alla prima chiamata e poi riusati
+        selector = self.get_selector()
+        prompt = self.get_prompt()
+        # Cache semantica delle risposte validate: domande simili non richiamano l'LLM
+        answer_cache = SemanticAnswerCache(self.config.get('answer_cache_dir', 'tesi_answer_cache'),
+                                           embedding_model=selector.model_name,
+                                           llm_model=self.client.model_name,
+                                           prefix_hash=prompt.prefix_hash,
+                                           threshold=self.config.get('answer_cache_threshold', 0.95))
         
         print(" (Scrivi 'back', 'exit' o 'esci' per tornare al menu principale)")
         
@@ -68,9 +126,23 @@ class AgriQueryPipeline:
             
             # Torna al menu principale invece di chiudere lo script
             if user_q.lower() in ['exit', 'quit', 'esci', 'back', 'indietro']:
+                selector.query_cache.flush()
+                answer_cache.flush()
+                cache_stats = selector.query_cache.stats()
+                print(f"\n Cache embedding domande: hit rate {cache_stats['hit_rate']} ({cache_stats})")
                 print("\n Ritorno al menu principale")
                 break
                 
+            question_vec = selector.embed_question(user_q)
+            # Vettore nullo = embedding della domanda fallito: niente lookup né salvataggio in cache
+            embedded = bool(question_vec.any())
+            cached = answer_cache.lookup(question_vec, prompt.schema_hash) if embedded else None
+            if cached:
+                entry, similarity = cached
+                print(f"\n[CACHE] Risposta dalla voce #{entry['entry_id']} (similarità {similarity:.3f}): {entry['question']}")
+                print(f"\n[QUERY GENERATA]:\n{entry['query']}")
+                continue
+
             print("Analisi domanda e selezione esempi simili")
             few_shot = selector.select_top_k(user_q, k=3)
 
@@ -84,66 +156,161 @@ class AgriQueryPipeline:
             
             print("Generazione query in corso")
             generated = self.client.generate_query(
-                instructions_path=self.config['instructions_path'], 
-                schema_context=schema,
+                prompt=prompt,
                 few_shot_examples=few_shot,
                 user_question=user_q
             )
             
             clean_query = self.extract_cypher(generated)
             print(f"\n[QUERY GENERATA]:\n{clean_query}")
+
+            # Solo le query confermate dall'operatore entrano nella cache delle risposte
+            if generated != self.client.ERROR_MESSAGE and embedded:
+                conferma = input("\nLa query è corretta? Salvarla in cache (s/N): ")
+                if conferma.lower() in ['s', 'si', 'sì', 'y', 'yes']:
+                    entry = answer_cache.store(user_q, clean_query, question_vec, prompt.schema_hash)
+                    print(f"Query salvata in cache (voce #{entry['entry_id']})")
     
-    def run_test(self, test_file_path: str, output_yaml_path: str, gt_file_path: str, output_results_path: str):
+    def run_test(self, test_file_path: str, output_yaml_path: str, gt_file_path: str, output_results_path: str,
+                 fresh: bool = False):
+        # Span per stadio e per query solo durante il test, esportati a fine run come trace Chrome/Perfetto:
+        # in modalità interattiva e nel servizio il tracer resta spento e non accumula span
+        if not self.config.get('trace', False):
+            self._run_test(test_file_path, output_yaml_path, gt_file_path, output_results_path, fresh)
+            return
+        tracer.reset()
+        tracer.enable()
+        try:
+            self._run_test(test_file_path, output_yaml_path, gt_file_path, output_results_path, fresh)
+        finally:
+            tracer.disable()
+            tracer.export_chrome(os.path.splitext(output_yaml_path)[0] + ".trace.json")
+            tracer.print_summary(f"Tempi per stadio ({self.client.model_name})")
+            tracer.reset()
+
+    def _run_test(self, test_file_path: str, output_yaml_path: str, gt_file_path: str, output_results_path: str,
+                  fresh: bool):
 
         print("Inizializzazione sistema in corso per il Test")
-        dataset = self.load_dataset()
-        schema = SchemaExtractor.get_full_prompt_context(self.config['refined_graph_path'])
         
-        selector = FewShotSelector(ground_truth_examples=dataset,token=token)
+        selector = self.get_selector()
+        prompt = self.get_prompt()
         
         print(f"Lettura domande di test da: {test_file_path}")
-        with open(test_file_path, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
-            test_queries = data.get('questions_test', data.get('responses_results', []))
+        with tracer.span('yaml_load', file='test'):
+            with open(test_file_path, 'r', encoding='utf-8') as f:
+                data = yaml.safe_load(f)
+                test_queries = data.get('questions_test', data.get('responses_results', []))
 
-        results_to_save = []
+        # Ogni query generata viene salvata subito nel checkpoint: una run interrotta riparte da dove si era fermata
+        checkpoint = JsonlCheckpoint(
+            os.path.splitext(output_yaml_path)[0] + ".checkpoint.jsonl",
+            signature={'model': self.client.model_name, 'prompt': prompt.prefix_hash, 'test_file': test_file_path},
+            fresh=fresh
+        )
+
+        from queryExecutor import QueryExecutor
+        executor = QueryExecutor.from_config(DB_CONFIG, self.config)
+        with tracer.span('yaml_load', file='ground_truth'):
+            gt_map = executor.load_queries(gt_file_path, 'responses_results')
+        exec_checkpoint = executor.open_checkpoint(output_results_path, fresh=fresh)
         total = len(test_queries)
-        print(f"\nInizio elaborazione Test per {total} query\n" + "="*50)
+        positions = {test['id']: i for i, test in enumerate(test_queries, 1)}
+
+        model = self.client.model_name
+
+        # Stadio 1 (rete): selezione few-shot e generazione della query con l'LLM
+        def generate(test: Dict) -> Optional[Dict]:
+            with tracer.span('generate', query_id=test['id'], model=model):
+                return generate_one(test)
 
-        for i, test in enumerate(test_queries, 1):
+        def generate_one(test: Dict) -> Optional[Dict]:
             q_id = test['id']
             nl_query = test['nl_query']
-            print(f"\n[{i}/{total}] Processando {q_id}: {nl_query}")
+            if checkpoint.is_done(q_id):
+                print(f"\n[{positions[q_id]}/{total}] {q_id} già generata (checkpoint)")
+                return checkpoint.records[str(q_id)]
+            print(f"\n[{positions[q_id]}/{total}] Processando {q_id}: {nl_query}")
 
             few_shot = selector.select_top_k(nl_query, k=3)
             
             generated_query = self.client.generate_query(
-                instructions_path=self.config['instructions_path'], 
-                schema_context=schema,
+                prompt=prompt,
                 few_shot_examples=few_shot,
                 user_question=nl_query
             )
             
-            clean_query = self.extract_cypher(generated_query)
-            
-            results_to_save.append({
+            if generated_query == self.client.ERROR_MESSAGE:
+                # Le generazioni fallite non vanno nel checkpoint: verranno ritentate alla prossima run
+                print(f"Generazione fallita per {q_id}, verrà ritentata al prossimo avvio")
+                return None
+            record = {
                 "id": q_id,
                 "nl_query": nl_query,
-                "query": clean_query
-            })
+                "query": self.extract_cypher(generated_query)
+            }
+            checkpoint.append(record)
+            return record
+
+        # Stadio 2 (database): esecuzione di GT e LLM
+        def execute(record: Dict) -> Optional[Dict]:
+            q_id = record['id']
+            if q_id not in gt_map:
+                return None
+            gt_query = gt_map[q_id]['query']
+            if executor.is_done(exec_checkpoint, q_id, gt_query, record['query']):
+                print(f"\nQuery {q_id}: già confrontata (checkpoint)")
+                return None
+            with tracer.span('execute', query_id=q_id, model=model):
+                return executor.execute_pair(q_id, gt_query, record['query'])
+
+        # Stadio 3 (CPU): confronto dei grafi risultanti
+        def compare(executed: Dict) -> None:
+            with tracer.span('compare', query_id=executed['query_id'], model=model):
+                exec_checkpoint.append(executor.compare_pair(executed))
+
+        print(f"\nInizio elaborazione Test per {total} query (generazione, esecuzione e confronto in pipeline)\n" + "="*50)
+        pipeline = StagedPipeline([
+            ("generazione", generate, 1),
+            # Ogni coppia occupa due connessioni (GT e LLM in parallelo)
+            ("esecuzione DB", execute, max(1, executor.workers // 2)),
+            ("confronto", compare, 1)
+        ])
+        results_to_save = []
+        compared_ids = []
+        benchmark = None
+        executor.connect()
+        try:
+            timings = pipeline.run(test_queries)
+
+            results_to_save = checkpoint.ordered([test['id'] for test in test_queries])
+            compared_ids = [r['id'] for r in results_to_save if r['id'] in gt_map]
+            # Benchmark di efficienza (benchmark_repeat in pipeline_conf.yaml) sulle query confrontate
+            if executor.benchmark_repeat > 0:
+                llm_queries = {r['id']: r['query'] for r in results_to_save}
+                benchmark = executor.benchmark(
+                    executor.benchmark_pairs(exec_checkpoint, gt_map, llm_queries, compared_ids), model)
+        finally:
+            executor.disconnect()
 
-        # Salvataggio nel file YAML
+        # I file finali vengono prodotti dai checkpoint
         with open(output_yaml_path, 'w', encoding='utf-8') as f:
             yaml.dump({"responses": results_to_save}, f, allow_unicode=True, sort_keys=False)
+        executor.save_output(exec_checkpoint, gt_file_path, output_yaml_path, output_results_path, compared_ids,
+                             benchmark)
             
         print("\n")
         print(f"Test LLM completato! Query generate salvate in: {output_yaml_path}")
-        print("Avvio della validazione su Database (QueryExecutor)")
-        print("")
-
-        # Esecuzione validazione sul db
-        executor = QueryExecutor(DB_CONFIG)
-        executor.run(gt_file=gt_file_path, llm_file=output_yaml_path, output_file=output_results_path)
+        print(f"Risultati del confronto salvati in: {output_results_path}")
+        print("Tempo per stadio: " + ", ".join(f"{name} {seconds:.1f}s" for name, seconds in timings.items()))
+        stats = prompt.stats()
+        print(f"Prefisso prompt riusato: {stats['reused_prefix_bytes']} byte su {stats['calls']} chiamate "
+              f"(ratio {stats['prefix_reuse_ratio']}, hash {stats['prefix_hash']})")
+        selector.query_cache.flush()
+        cache_stats = selector.query_cache.stats()
+        print(f"Cache embedding domande: hit rate {cache_stats['hit_rate']} ({cache_stats})")
+        if executor.result_cache is not None:
+            print(f"Cache risultati DB: {executor.result_cache.stats()}")
 
 
 # Configurazione Database per QueryExecutor
@@ -155,13 +322,18 @@ DB_CONFIG = {
     'password': os.getenv('DB_PASSWORD')
 }
 
+CONFIG_FILE = "Tesi/config/pipeline_conf.yaml"
+
+# Modelli disponibili: (nome visualizzato, nome modello, variabile d'ambiente del token)
+MODELLI = {
+    "1": ("DeepSeek V3 (Consigliato per codice)", "DeepSeek-V3-0324", "DEEPV3_TOKEN"),
+    "2": ("Codeestral", "Codestral-2501", "CODESTRAL_TOKEN"),
+    "3": ("OpenAI GPT-4o", "gpt-4o", "OPENAI_API_KEY"),
+    "4": ("LLaMA 3.3 70B Instruct", "Llama-3.3-70B-Instruct", "LLAMA_TOKEN"),
+}
+
 def menu_scelta_modello():
-    modelli = {
-        "1": ("DeepSeek V3 (Consigliato per codice)", "DeepSeek-V3-0324", "DEEPV3_TOKEN"),
-        "2": ("Codeestral", "Codestral-2501", "CODESTRAL_TOKEN"),
-        "3": ("OpenAI GPT-4o", "gpt-4o", "OPENAI_API_KEY"),
-        "4": ("LLaMA 3.3 70B Instruct", "Llama-3.3-70B-Instruct", "LLAMA_TOKEN"),
-    }
+    modelli = MODELLI
     
     while True:
         print("\n")
@@ -181,8 +353,11 @@ def menu_scelta_modello():
         print("Scelta non valida, riprova.")
 
 if __name__ == "__main__":
-    CONFIG_FILE = "Tesi/config/pipeline_conf.yaml"
-    
+    parser = argparse.ArgumentParser(description='Pipeline NL -> Cypher: chat interattiva e test sul database agricolo')
+    parser.add_argument('--config', default=CONFIG_FILE, help=f'File di configurazione (default: {CONFIG_FILE})')
+    parser.add_argument('--fresh', action='store_true', help='Test da zero: ignora i checkpoint delle run precedenti')
+    args = parser.parse_args()
+
     #Gestisce il cambio di modello LLM
     while True:
         modello_selezionato, token_env_name = menu_scelta_modello()
@@ -196,7 +371,7 @@ if __name__ == "__main__":
         
         try:
             #passiamo anche il token all'inizializzazione della pipeline
-            app = AgriQueryPipeline(CONFIG_FILE, selected_model=modello_selezionato, token=token)
+            app = AgriQueryPipeline(args.config, selected_model=modello_selezionato, token=token)
         except Exception as e:
             print(f"\nErrore durante l'inizializzazione: {e}")
             input("Premi INVIO per riprovare")
@@ -225,7 +400,8 @@ if __name__ == "__main__":
                     test_file_path="Tesi/Query_test/QueryTest.yaml", 
                     output_yaml_path=out_yaml,
                     gt_file_path="Tesi/Query_test/groundTruth.yaml",
-                    output_results_path=out_results
+                    output_results_path=out_results,
+                    fresh=args.fresh
                 )
                 input("\nPremi INVIO per tornare al menu principale")
             elif scelta == '3':
@@ -1,22 +1,33 @@
-import yaml
 import json
 import argparse
 import sys
 import os
+import hashlib
+import math
+import time
+import statistics
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from typing import Dict, Optional
-from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from db_conn import db_conn as db_conn_module
-from CompareGraph import CompareGraph
+from JsonlCheckpoint import JsonlCheckpoint
+from Tracer import tracer
 
 load_dotenv()
 
+# Esiti che alla ripresa da checkpoint vengono rieseguiti
+RETRY_OUTCOMES = ('error', 'timeout')
+
 class QueryExecutor:
     
-    def __init__(self, db_config: Dict[str, Optional[str]]):
+    def __init__(self, db_config: Dict[str, Optional[str]], workers: int = 1,
+                 statement_timeout_ms: Optional[int] = None, max_cost: Optional[float] = None,
+                 max_rows: Optional[float] = None, stream: bool = False, itersize: int = 2000,
+                 result_cache_dir: Optional[str] = None, benchmark_repeat: int = 0, benchmark_warmup: int = 1,
+                 capture_plans: bool = False, decode: str = 'json'):
        # Convert None
         clean_config = {k: (v or "") for k, v in db_config.items()}
 
@@ -24,40 +35,415 @@ class QueryExecutor:
             if not value:
                 raise ValueError(f"Missing DB config value for '{key}'")
 
+        # psycopg2 viene caricato solo quando serve davvero una connessione, non per --help
+        from db_conn import db_conn as db_conn_module
         self.db = db_conn_module(clean_config)
+        # Con più worker le query girano in parallelo su un pool di connessioni
+        self.workers = max(1, workers)
+        self._query_pool: Optional[ThreadPoolExecutor] = None
+        # Limiti per le query generate: timeout lato server e budget sulla stima del planner
+        self.statement_timeout_ms = statement_timeout_ms
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        # Streaming: righe lette a blocchi da un cursore lato server e ridotte subito a nodi/archi
+        self.stream = stream
+        self.itersize = itersize
+        # Cache dei nodi/archi estratti: le query già eseguite sullo stesso stato del DB non vengono rieseguite
+        self.result_cache = None
+        if result_cache_dir:
+            from ResultCache import ResultCache
+            self.result_cache = ResultCache(result_cache_dir)
+        # Benchmark (0 = disattivato): riscaldamento + ripetizioni cronometrate per ogni query GT e LLM
+        self.benchmark_repeat = benchmark_repeat
+        self.benchmark_warmup = benchmark_warmup
+        # Piani EXPLAIN ANALYZE di GT e LLM salvati accanto alle metriche e confrontati
+        self.capture_plans = capture_plans
+        # "json": righe convertite in JSON dal server e decodificate una volta dal driver;
+        # "classic": valori agtype testuali analizzati qui con parse_agtype
+        if decode not in ('json', 'classic'):
+            raise ValueError(f"Unknown decode mode '{decode}'")
+        self.decode = decode
+
+    @classmethod
+    def from_config(cls, db_config: Dict[str, Optional[str]], config: Dict, **overrides) -> 'QueryExecutor':
+        # Parametri di esecuzione letti da pipeline_conf.yaml
+        params = {
+            'workers': config.get('db_workers', 1),
+            'statement_timeout_ms': config.get('db_statement_timeout_ms'),
+            'max_cost': config.get('db_max_cost'),
+            'max_rows': config.get('db_max_rows'),
+            'stream': config.get('db_stream', False),
+            'itersize': config.get('db_itersize', 2000),
+            'result_cache_dir': config.get('result_cache_dir'),
+            'benchmark_repeat': config.get('benchmark_repeat', 0),
+            'benchmark_warmup': config.get('benchmark_warmup', 1),
+            'capture_plans': config.get('capture_plans', False),
+            'decode': config.get('db_decode', 'json')
+        }
+        params.update(overrides)
+        return cls(db_config, **params)
+
+    def connect(self):
+        if self.workers > 1:
+            self.db.connect_pool(self.workers)
+            self._query_pool = ThreadPoolExecutor(max_workers=self.workers)
+        else:
+            self.db.connect()
+        if self.result_cache is not None:
+            # Impronta calcolata una volta per run: vale per tutte le query eseguite
+            with tracer.span('db_snapshot'):
+                config = self.db.db_config
+                self.result_cache.set_snapshot(self.db.snapshot_fingerprint(),
+                                               f"{config['host']}:{config['port']}/{config['database']}")
+
+    def disconnect(self):
+        if self._query_pool is not None:
+            self._query_pool.shutdown(wait=True)
+            self._query_pool = None
+        self.db.disconnect()
     
-    def execute_query(self, query: str, query_id: str) -> Dict:
+    def over_budget(self, estimate: Dict[str, float]) -> Optional[str]:
+        if self.max_cost is not None and estimate['cost'] > self.max_cost:
+            return f"estimated cost {estimate['cost']:.0f} > budget {self.max_cost:.0f}"
+        if self.max_rows is not None and estimate['rows'] > self.max_rows:
+            return f"estimated rows {estimate['rows']:.0f} > budget {self.max_rows:.0f}"
+        return None
+
+    def execute_query(self, query: str, query_id: str, budget: bool = True) -> Dict:
+        # Esiti: "ok", "error", "timeout" (annullata dallo statement_timeout), "rejected" (fuori budget).
+        # Il budget di EXPLAIN vale solo per le query generate: la ground truth (budget=False) gira sempre
+        from db_conn import QueryTimeout
         
         try:
-            start = datetime.now()
-            rows, columns = self.db.execute_raw(query)
-            exec_time = (datetime.now() - start).total_seconds()
-            
-            results = []
-            for row in rows:
-                row_dict = {}
-                for i, value in enumerate(row):
-                    row_dict[columns[i]] = self.db.parse_agtype(value)
-                results.append(row_dict)
+            if budget and (self.max_cost is not None or self.max_rows is not None):
+                # Pre-flight: la query non parte se la stima del planner supera il budget. Il controllo
+                # precede la cache: una query fuori budget viene rifiutata anche se il suo risultato è in cache
+                with tracer.span('explain', query_id=query_id) as span:
+                    estimate = self.db.explain(query, self.statement_timeout_ms)
+                    span.update(estimate)
+                reason = self.over_budget(estimate)
+                if reason:
+                    print(f"{query_id}: rejected ({reason})")
+                    return {"query_id": query_id, "results": [], "outcome": "rejected",
+                            "error": reason, "estimate": estimate}
+
+            if self.result_cache is not None:
+                cached = self.result_cache.get(query)
+                if cached is not None:
+                    nodes, edges = cached['elements']
+                    print(f"{query_id}: cached ({cached['rows']} rows, {len(nodes)} nodes, {len(edges)} edges)")
+                    result = {"query_id": query_id, "results": [], "rows": cached['rows'],
+                              "elements": cached['elements'], "outcome": "ok", "cached": True}
+                    # La cache conserva solo nodi e archi: il piano va comunque catturato
+                    if self.capture_plans:
+                        result['plan'] = self.capture_plan(query, query_id)
+                    return result
+
+            if self.stream:
+                result = self.stream_query(query, query_id)
+                if self.result_cache is not None:
+                    self.result_cache.put(query, result['elements'], result['rows'])
+                if self.capture_plans:
+                    result['plan'] = self.capture_plan(query, query_id)
+                return result
+
+            start = time.perf_counter()
+            results = self.execute_json(query, query_id) if self.decode == 'json' else None
+            if results is None:
+                with tracer.span('db_execution', query_id=query_id) as span:
+                    rows, columns = self.db.execute_raw(query, self.statement_timeout_ms)
+                    span['rows'] = len(rows)
+                
+                results = []
+                with tracer.span('parse_agtype', query_id=query_id, rows=len(rows)):
+                    for row in rows:
+                        row_dict = {}
+                        for i, value in enumerate(row):
+                            row_dict[columns[i]] = self.db.parse_agtype(value)
+                        results.append(row_dict)
+            exec_time = time.perf_counter() - start
             
             print(f"{query_id}: {len(results)} rows, {exec_time:.3f}s")
-            return {"query_id": query_id, "results": results}
+            result = {"query_id": query_id, "results": results, "outcome": "ok"}
+            if self.result_cache is not None:
+                from CompareGraph import CompareGraph
+                with tracer.span('extract_elements', query_id=query_id):
+                    result['elements'] = CompareGraph.extract_graph_elements(results)
+                self.result_cache.put(query, result['elements'], len(results))
+            if self.capture_plans:
+                result['plan'] = self.capture_plan(query, query_id)
+            return result
             
+        except QueryTimeout as e:
+            print(f"Timeout in {query_id}: {e}")
+            return {"query_id": query_id, "results": [], "outcome": "timeout", "error": str(e)}
         except Exception as e:
             print(f"Errore in {query_id}: {e}")
-            return {"query_id": query_id, "results": [], "error": str(e)}
+            return {"query_id": query_id, "results": [], "outcome": "error", "error": str(e)}
     
-    def run(self, gt_file: str, llm_file: str, output_file: str):
+    def execute_json(self, query: str, query_id: str) -> Optional[List[Dict]]:
+        # Righe già decodificate (dict/list) dal server; None se la query non si presta all'incapsulamento
+        # (un tipo senza cast a json): solo in quel caso si ripiega sulla modalità classica.
+        # Gli altri errori (sintassi, timeout, connessione) sono errori della query e vengono propagati
+        import psycopg2.errors
+        try:
+            with tracer.span('db_execution', query_id=query_id, decode='json') as span:
+                results = self.db.execute_json(query, self.statement_timeout_ms)
+                span['rows'] = len(results)
+            return results
+        except (psycopg2.errors.CannotCoerce, psycopg2.errors.UndefinedFunction) as e:
+            print(f"{query_id}: JSON mode failed ({str(e).strip()}), retrying in classic mode")
+            return None
+
+    def capture_plan(self, query: str, query_id: str) -> Optional[Dict]:
+        # Seconda esecuzione con EXPLAIN ANALYZE: un errore qui non invalida il risultato della query
+        try:
+            with tracer.span('explain_analyze', query_id=query_id):
+                return self.db.explain_analyze(query, self.statement_timeout_ms)
+        except Exception as e:
+            print(f"{query_id}: plan not captured ({e})")
+            return None
+
+    def stream_query(self, query: str, query_id: str) -> Dict:
+        # Le righe non vengono conservate: restano solo gli insiemi di nodi e archi distinti
+        from CompareGraph import GraphBuilder
+        builder = GraphBuilder()
+        start = time.perf_counter()
+        with tracer.span('db_stream', query_id=query_id) as span:
+            for row in self.db.stream_raw(query, self.itersize, self.statement_timeout_ms):
+                builder.add_row(row)
+            span['rows'] = builder.rows
+        exec_time = time.perf_counter() - start
+
+        elements = builder.elements()
+        nodes, edges = elements
+        print(f"{query_id}: {builder.rows} rows streamed ({len(nodes)} nodes, {len(edges)} edges), {exec_time:.3f}s")
+        return {"query_id": query_id, "results": [], "rows": builder.rows,
+                "elements": elements, "outcome": "ok"}
+
+    @staticmethod
+    def load_queries(yaml_file: str, key: str) -> Dict[str, Dict]:
+        import yaml
+        with open(yaml_file, 'r') as f:
+            data = yaml.safe_load(f)
+        return {q['id']: q for q in data.get(key, [])}
+
+    def pair_fingerprint(self, gt_query: str, llm_query: str) -> str:
+        # Con capture_plans l'impronta cambia: un record senza piani non vale per una run che li chiede
+        key = f"{gt_query}\x00{llm_query}" + ("\x00plans" if self.capture_plans else "")
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+    def open_checkpoint(self, output_file: str, fresh: bool = False) -> JsonlCheckpoint:
+        # Checkpoint per query: un'interruzione non fa rieseguire le query già confrontate.
+        # Ogni record porta l'impronta della coppia GT/LLM, così una query rigenerata viene rieseguita
+        return JsonlCheckpoint(output_file + ".checkpoint.jsonl", signature={'output_file': output_file},
+                               id_field='query_id', fresh=fresh)
+
+    def is_done(self, checkpoint: JsonlCheckpoint, q_id: str, gt_query: str, llm_query: str) -> bool:
+        record = checkpoint.records.get(str(q_id))
+        if record is None or record.get('fingerprint') != self.pair_fingerprint(gt_query, llm_query):
+            return False
+        # Errori e timeout possono essere transitori (connessione caduta, DB carico): alla ripresa si riprovano.
+        # Le query rifiutate dal budget di EXPLAIN restano invece completate
+        outcome = record.get('outcome', {})
+        return not any(outcome.get(side) in RETRY_OUTCOMES for side in ('gt', 'llm'))
+
+    def execute_pair(self, q_id: str, gt_query: str, llm_query: str) -> Dict:
+        print(f"\nQuery {q_id}:")
+        if self._query_pool is not None:
+            # GT e LLM della stessa query in parallelo su due connessioni del pool
+            gt_future, llm_future = self.submit_pair(q_id, gt_query, llm_query)
+            return self.pair_result(q_id, gt_query, llm_query, gt_future.result(), llm_future.result())
+        return self.pair_result(q_id, gt_query, llm_query,
+                                self.execute_query(gt_query, f"{q_id}_GT", budget=False),
+                                self.execute_query(llm_query, f"{q_id}_LLM"))
+
+    def submit_pair(self, q_id: str, gt_query: str, llm_query: str):
+        return (self._query_pool.submit(self.execute_query, gt_query, f"{q_id}_GT", False),
+                self._query_pool.submit(self.execute_query, llm_query, f"{q_id}_LLM"))
+
+    def pair_result(self, q_id: str, gt_query: str, llm_query: str, gt_result: Dict, llm_result: Dict) -> Dict:
+        return {
+            'query_id': q_id,
+            'fingerprint': self.pair_fingerprint(gt_query, llm_query),
+            'gt': gt_result,
+            'llm': llm_result
+        }
+
+    def compare_pair(self, executed: Dict) -> Dict:
+        q_id = executed['query_id']
+        gt_result = executed['gt']
+        llm_result = executed['llm']
+        from CompareGraph import CompareGraph
+
+        # Comparison
+        if 'error' not in gt_result and 'error' not in llm_result:
+            with tracer.span('compare_graph', query_id=q_id) as span:
+                # Insiemi già estratti (streaming o cache) quando disponibili, altrimenti dalle righe
+                gt_elements = gt_result.get('elements') or CompareGraph.extract_graph_elements(gt_result['results'])
+                llm_elements = llm_result.get('elements') or CompareGraph.extract_graph_elements(llm_result['results'])
+                metrics = CompareGraph.compare_elements(gt_elements, llm_elements, q_id)
+                span.update(nodes_gt=metrics.nodes_gt, nodes_llm=metrics.nodes_llm,
+                            edges_gt=metrics.edges_gt, edges_llm=metrics.edges_llm)
+            
+            print(f"  {q_id} Nodes: GT={metrics.nodes_gt}, LLM={metrics.nodes_llm}")
+            print(f"  {q_id} Edges: GT={metrics.edges_gt}, LLM={metrics.edges_llm}")
+            record = {
+                'query_id': q_id,
+                'fingerprint': executed['fingerprint'],
+                'nodes_gt': metrics.nodes_gt,
+                'nodes_llm': metrics.nodes_llm,
+                'edges_gt': metrics.edges_gt,
+                'edges_llm': metrics.edges_llm,
+                'missing_llm': metrics.missing_llm,
+                'extra_llm': metrics.extra_llm
+            }
+            if gt_result.get('plan') and llm_result.get('plan'):
+                from PlanDiff import PlanDiff
+                record['plan_diff'] = PlanDiff.diff(gt_result['plan'], llm_result['plan'])
+                record['plans'] = {'gt': gt_result['plan'], 'llm': llm_result['plan']}
+                for finding in record['plan_diff']['findings']:
+                    print(f"  {q_id} Plan: {finding}")
+            return record
+
+        return {
+            'query_id': q_id,
+            'fingerprint': executed['fingerprint'],
+            'outcome': {
+                'gt': gt_result.get('outcome', 'error'),
+                'llm': llm_result.get('outcome', 'error')
+            },
+            'error': {
+                'gt': gt_result.get('error'),
+                'llm': llm_result.get('error')
+            }
+        }
+
+    @staticmethod
+    def percentile(sorted_values: List[float], fraction: float) -> float:
+        # Nearest-rank su valori già ordinati
+        return sorted_values[min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))]
+
+    @staticmethod
+    def plan_buffers(plan: Dict) -> Dict[str, int]:
+        # Il nodo radice riporta i buffer cumulativi di tutto il piano
+        root = plan.get('Plan', {})
+        keys = ['Shared Hit Blocks', 'Shared Read Blocks', 'Shared Dirtied Blocks',
+                'Temp Read Blocks', 'Temp Written Blocks']
+        return {key.lower().replace(' ', '_'): int(root.get(key, 0)) for key in keys}
+
+    def benchmark_query(self, query: str, query_id: str) -> Dict:
+        try:
+            for _ in range(self.benchmark_warmup):
+                self.db.execute_raw(query, self.statement_timeout_ms)
+            timings = []
+            rows = []
+            for _ in range(self.benchmark_repeat):
+                start = time.perf_counter()
+                rows, _ = self.db.execute_raw(query, self.statement_timeout_ms)
+                timings.append(time.perf_counter() - start)
+            # Un'esecuzione in più, fuori dai tempi, per righe e buffer visti dal server
+            with tracer.span('explain_analyze', query_id=query_id):
+                plan = self.db.explain_analyze(query, self.statement_timeout_ms)
+        except Exception as e:
+            print(f"Benchmark {query_id}: errore {e}")
+            return {'query_id': query_id, 'error': str(e)}
+
+        timings.sort()
+        result = {
+            'query_id': query_id,
+            'runs': len(timings),
+            'rows': len(rows),
+            'min_ms': round(timings[0] * 1000, 3),
+            'median_ms': round(statistics.median(timings) * 1000, 3),
+            'p95_ms': round(self.percentile(timings, 0.95) * 1000, 3),
+            'planning_ms': plan.get('Planning Time'),
+            'execution_ms': plan.get('Execution Time'),
+            'plan_rows': plan.get('Plan', {}).get('Actual Rows'),
+            'buffers': self.plan_buffers(plan)
+        }
+        print(f"Benchmark {query_id}: median {result['median_ms']:.1f} ms, p95 {result['p95_ms']:.1f} ms, "
+              f"{result['rows']} rows, buffers hit/read {result['buffers']['shared_hit_blocks']}/"
+              f"{result['buffers']['shared_read_blocks']}")
+        return result
+
+    def benchmark(self, pairs: Dict[str, Tuple[str, str]], model: Optional[str] = None) -> Dict:
+        # Eseguito in sequenza su una connessione alla volta, per non falsare i tempi con la concorrenza
+        print(f"\nBenchmark di {len(pairs)} query ({self.benchmark_warmup} warm-up, {self.benchmark_repeat} ripetizioni)")
+        queries = []
+        slowdowns = []
+        for q_id in sorted(pairs):
+            gt_query, llm_query = pairs[q_id]
+            with tracer.span('benchmark', query_id=q_id):
+                gt = self.benchmark_query(gt_query, f"{q_id}_GT")
+                llm = self.benchmark_query(llm_query, f"{q_id}_LLM")
+            entry = {'query_id': q_id, 'gt': gt, 'llm': llm}
+            if 'error' not in gt and 'error' not in llm and gt['median_ms'] > 0:
+                # Rapporto > 1: la query LLM è più lenta della ground truth
+                entry['slowdown'] = round(llm['median_ms'] / gt['median_ms'], 3)
+                slowdowns.append(entry['slowdown'])
+            queries.append(entry)
+
+        summary = {
+            'model': model,
+            'queries': len(queries),
+            'compared': len(slowdowns),
+            'warmup': self.benchmark_warmup,
+            'repeat': self.benchmark_repeat
+        }
+        if slowdowns:
+            summary.update({
+                'geomean_slowdown': round(math.exp(sum(math.log(s) for s in slowdowns) / len(slowdowns)), 3),
+                'median_slowdown': round(statistics.median(slowdowns), 3),
+                'max_slowdown': max(slowdowns),
+                'slower': sum(1 for s in slowdowns if s > 1),
+                'faster': sum(1 for s in slowdowns if s < 1)
+            })
+            print(f"Slowdown LLM/GT ({model or 'LLM'}): media geometrica {summary['geomean_slowdown']}x, "
+                  f"mediana {summary['median_slowdown']}x, peggiore {summary['max_slowdown']}x")
+        return {'summary': summary, 'queries': queries}
+
+    def benchmark_pairs(self, checkpoint: JsonlCheckpoint, gt_map: Dict, llm_queries: Dict[str, str],
+                        query_ids) -> Dict[str, Tuple[str, str]]:
+        # Solo le query confrontate senza errori: timeout e rifiuti non vengono rieseguiti
+        pairs = {}
+        for q_id in query_ids:
+            record = checkpoint.records.get(str(q_id))
+            if record is not None and 'error' not in record:
+                pairs[q_id] = (gt_map[q_id]['query'], llm_queries[q_id])
+        return pairs
+
+    def save_output(self, checkpoint: JsonlCheckpoint, gt_file: str, llm_file: str, output_file: str, query_ids,
+                    benchmark: Optional[Dict] = None):
+        # Save results (dal checkpoint, senza i campi interni)
+        comparisons = [{k: v for k, v in record.items() if k != 'fingerprint'}
+                       for record in checkpoint.ordered(sorted(query_ids))]
+        # Conteggio degli esiti per lato (ok / error / timeout / rejected)
+        outcomes = {'gt': {}, 'llm': {}}
+        for record in comparisons:
+            for side in ('gt', 'llm'):
+                outcome = record.get('outcome', {}).get(side, 'ok')
+                outcomes[side][outcome] = outcomes[side].get(outcome, 0) + 1
+        output = {
+            'gt_file': gt_file,
+            'llm_file': llm_file,
+            'outcomes': outcomes,
+            'comparisons': comparisons
+        }
+        if benchmark is not None:
+            output['benchmark'] = benchmark
         
-        # Carica YAML
-        with open(gt_file, 'r') as f:
-            gt_data = yaml.safe_load(f)
-        with open(llm_file, 'r') as f:
-            llm_data = yaml.safe_load(f)
+        with open(output_file, 'w') as f:
+            json.dump(output, f, indent=2, ensure_ascii=False)
         
-        # Crea mapping
-        gt_map = {q['id']: q for q in gt_data.get('responses_results', [])}
-        llm_map = {q['id']: q for q in llm_data.get('responses', [])}
+        print(f"\nResults saved to: {output_file}\n")
+
+    def run(self, gt_file: str, llm_file: str, output_file: str, model: Optional[str] = None, fresh: bool = False):
+        
+        # Carica YAML e crea mapping
+        with tracer.span('yaml_load'):
+            gt_map = self.load_queries(gt_file, 'responses_results')
+            llm_map = self.load_queries(llm_file, 'responses')
         
         # Query comuni
         query_ids = set(gt_map.keys()) & set(llm_map.keys())
@@ -66,65 +452,53 @@ class QueryExecutor:
         print(f"Comparing {len(query_ids)} queries")
         print(f"{'='*70}\n")
         
-        # Connetti DB
-        self.db.connect()
+        checkpoint = self.open_checkpoint(output_file, fresh=fresh)
+        pending = []
+        for q_id in sorted(query_ids):
+            if self.is_done(checkpoint, q_id, gt_map[q_id]['query'], llm_map[q_id]['query']):
+                print(f"\nQuery {q_id}: già completata (checkpoint)")
+            else:
+                pending.append(q_id)
         
-        comparisons = []
+        # Connetti DB
+        self.connect()
         
         try:
-            for q_id in sorted(query_ids):
-                print(f"\nQuery {q_id}:")
-                
-                gt_query = gt_map[q_id]['query']
-                llm_query = llm_map[q_id]['query']
-                
-                gt_result = self.execute_query(gt_query, f"{q_id}_GT")
-                llm_result = self.execute_query(llm_query, f"{q_id}_LLM")
-                
-                # Comparison
-                if 'error' not in gt_result and 'error' not in llm_result:
-                    metrics = CompareGraph.compare(
-                        gt_result['results'],
-                        llm_result['results'],
-                        q_id
-                    )
-                    
-                    comparisons.append({
-                        'query_id': q_id,
-                        'nodes_gt': metrics.nodes_gt,
-                        'nodes_llm': metrics.nodes_llm,
-                        'edges_gt': metrics.edges_gt,
-                        'edges_llm': metrics.edges_llm,
-                        'missing_llm': metrics.missing_llm,
-                        'extra_llm': metrics.extra_llm
-                    })
-                    
-                    print(f"  Nodes: GT={metrics.nodes_gt}, LLM={metrics.nodes_llm}")
-                    print(f"  Edges: GT={metrics.edges_gt}, LLM={metrics.edges_llm}")
-                    
-                else:
-                    comparisons.append({
-                        'query_id': q_id,
-                        'error': {
-                            'gt': gt_result.get('error'),
-                            'llm': llm_result.get('error')
-                        }
-                    })
+            if self._query_pool is not None:
+                # Finestra di coppie in volo (2 per worker): i worker hanno sempre lavoro pronto mentre
+                # qui si confrontano le coppie in ordine, senza accodare subito tutte le query
+                window = 2 * self.workers
+                in_flight = deque()
+
+                def finish_oldest():
+                    q_id, (gt_future, llm_future) = in_flight.popleft()
+                    executed = self.pair_result(q_id, gt_map[q_id]['query'], llm_map[q_id]['query'],
+                                                gt_future.result(), llm_future.result())
+                    checkpoint.append(self.compare_pair(executed))
+
+                for q_id in pending:
+                    if len(in_flight) >= window:
+                        finish_oldest()
+                    in_flight.append((q_id, self.submit_pair(q_id, gt_map[q_id]['query'], llm_map[q_id]['query'])))
+                while in_flight:
+                    finish_oldest()
+            else:
+                for q_id in pending:
+                    executed = self.execute_pair(q_id, gt_map[q_id]['query'], llm_map[q_id]['query'])
+                    checkpoint.append(self.compare_pair(executed))
+
+            benchmark = None
+            if self.benchmark_repeat > 0:
+                llm_queries = {q_id: llm_map[q_id]['query'] for q_id in query_ids}
+                benchmark = self.benchmark(self.benchmark_pairs(checkpoint, gt_map, llm_queries, query_ids),
+                                           model or os.path.splitext(os.path.basename(llm_file))[0])
         
         finally:
-            self.db.disconnect()
+            self.disconnect()
         
-        # Save results
-        output = {
-            'gt_file': gt_file,
-            'llm_file': llm_file,
-            'comparisons': comparisons
-        }
-        
-        with open(output_file, 'w') as f:
-            json.dump(output, f, indent=2, ensure_ascii=False)
-        
-        print(f"\nResults saved to: {output_file}\n")
+        if self.result_cache is not None:
+            print(f"Result cache: {self.result_cache.stats()}")
+        self.save_output(checkpoint, gt_file, llm_file, output_file, query_ids, benchmark)
 
 
 # Config database
@@ -142,15 +516,46 @@ def main():
     parser.add_argument('gt_file', help='Ground truth YAML file')
     parser.add_argument('llm_file', help='LLM generated YAML file')
     parser.add_argument('output_file', help='Output JSON file')
+    parser.add_argument('--trace', metavar='TRACE_JSON', help='Save per-stage spans as a Chrome/Perfetto trace')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Parallel queries, one pooled connection each (default: 1, sequential)')
+    parser.add_argument('--timeout-ms', type=int, help='statement_timeout applied to every query')
+    parser.add_argument('--max-cost', type=float, help='Reject LLM queries whose EXPLAIN total cost exceeds this')
+    parser.add_argument('--max-rows', type=float, help='Reject LLM queries whose EXPLAIN row estimate exceeds this')
+    parser.add_argument('--stream', action='store_true',
+                        help='Fetch rows with a server-side cursor and build node/edge sets incrementally')
+    parser.add_argument('--itersize', type=int, default=2000, help='Rows per fetch in streaming mode')
+    parser.add_argument('--benchmark', type=int, default=0, metavar='N',
+                        help='Time every compared GT/LLM query N times and report LLM/GT slowdown')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed warm-up runs per query in benchmark mode')
+    parser.add_argument('--model', help='Model name for the benchmark summary (default: LLM file name)')
+    parser.add_argument('--plans', action='store_true',
+                        help='Capture EXPLAIN (ANALYZE, BUFFERS) plans for GT and LLM queries and diff them')
+    parser.add_argument('--decode', choices=['classic', 'json'], default='json',
+                        help='json (default, as db_decode in pipeline_conf.yaml): rows converted to JSON by '
+                             'PostgreSQL and decoded once by the driver; classic: agtype text parsed here')
+    parser.add_argument('--result-cache', metavar='DIR',
+                        help='Reuse node/edge sets of queries already run on the same DB snapshot')
+    parser.add_argument('--fresh', action='store_true', help='Ignore the checkpoint and rerun every query')
     
     args = parser.parse_args()
+    if args.trace:
+        tracer.enable()
     
     try:
-        executor = QueryExecutor(DB_CONFIG)
-        executor.run(args.gt_file, args.llm_file, args.output_file)
+        executor = QueryExecutor(DB_CONFIG, workers=args.workers, statement_timeout_ms=args.timeout_ms,
+                                 max_cost=args.max_cost, max_rows=args.max_rows,
+                                 stream=args.stream, itersize=args.itersize, result_cache_dir=args.result_cache,
+                                 benchmark_repeat=args.benchmark, benchmark_warmup=args.warmup,
+                                 capture_plans=args.plans, decode=args.decode)
+        executor.run(args.gt_file, args.llm_file, args.output_file, model=args.model, fresh=args.fresh)
     except Exception as e:
         print(f"\nError: {e}")
         raise
+    finally:
+        if args.trace:
+            tracer.export_chrome(args.trace)
+            tracer.print_summary()
 
 
 if __name__ == "__main__":
@@ -1,9 +1,10 @@
-import yaml
 import argparse
 from difflib import unified_diff
 from datetime import datetime
 
 def load_yaml_file(file_path):
+    # yaml importato qui: --help non deve pagarne il caricamento
+    import yaml
     try:
         with open(file_path, 'r', encoding='utf-8') as file:
             return yaml.safe_load(file)